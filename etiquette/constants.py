@@ -41,7 +41,7 @@ ffmpeg = _load_ffmpeg()
 
 # Database #########################################################################################
 
-DATABASE_VERSION = 25
+DATABASE_VERSION = 26
 
 DB_INIT = '''
 CREATE TABLE IF NOT EXISTS albums(
@@ -73,7 +73,7 @@ CREATE TABLE IF NOT EXISTS photos(
     filepath TEXT COLLATE NOCASE,
     override_filename TEXT COLLATE NOCASE,
     mtime INT,
-    sha256 TEXT,
+    sha256 BLOB,
     width INT,
     height INT,
     duration INT,
@@ -106,6 +106,7 @@ CREATE INDEX IF NOT EXISTS index_photos_created on photos(created);
 CREATE INDEX IF NOT EXISTS index_photos_extension on photos(extension);
 CREATE INDEX IF NOT EXISTS index_photos_author_id on photos(author_id);
 CREATE INDEX IF NOT EXISTS index_photos_searchhidden_created on photos(searchhidden, created);
+CREATE INDEX IF NOT EXISTS index_photos_sha256 on photos(sha256);
 ----------------------------------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS tags(
     id INT PRIMARY KEY NOT NULL,
@@ -346,6 +347,15 @@ DEFAULT_CONFIGURATION = {
         },
     },
 
+    'sqlite': {
+        # The page cache of the write connection, in KiB. This is about the
+        # same as the 10000 pages that were used with 4 KiB pages.
+        'cache_size_kib': 40000,
+        # The number of bytes of the database file which may be memory-mapped
+        # instead of read. 0 leaves memory-mapped I/O off.
+        'mmap_size': 0,
+    },
+
     'tag': {
         'min_length': 1,
         'max_length': 32,
@@ -353,6 +363,9 @@ DEFAULT_CONFIGURATION = {
     },
 
     'user': {
+        # The bcrypt cost factor for hashing passwords. Each increment doubles
+        # the time it takes to hash, and so to check, a password.
+        'bcrypt_rounds': 12,
         'min_username_length': 2,
         'min_password_length': 6,
         'max_display_name_length': 24,
@@ -373,7 +386,9 @@ DEFAULT_CONFIGURATION = {
     ],
 
     'file_read_chunk': 2 ** 20,
+    'hash_chunk_size': 4 * 2 ** 20,
     'id_bits': 32,
+    'read_connections': 4,
     'thumbnail_width': 400,
     'thumbnail_height': 400,
 
@@ -8,6 +8,36 @@ from . import exceptions
 
 NOT_CACHED = sentinel.Sentinel('not cached')
 
+def atomic_generator(method):
+    '''
+    Like worms.atomic, but for generator methods. worms.atomic only covers the
+    call that creates the generator, which returns before any of the body has
+    run. This decorator holds one savepoint for the entire iteration, so the
+    work of a bulk operation is rolled back together if it raises partway.
+
+    If the caller stops iterating early, the work done so far is kept.
+    '''
+    @functools.wraps(method)
+    def wrapped_atomic_generator(self, *args, **kwargs):
+        database = self._worms_database
+
+        is_root = len(database.savepoints) == 0
+        savepoint_id = database.savepoint(message=method.__qualname__)
+
+        try:
+            yield from method(self, *args, **kwargs)
+        except GeneratorExit:
+            pass
+        except BaseException:
+            database.rollback(savepoint=savepoint_id)
+            raise
+
+        if not is_root:
+            database.release_savepoint(savepoint=savepoint_id)
+
+    wrapped_atomic_generator.is_worms_atomic = True
+    return wrapped_atomic_generator
+
 def cache_until_commit(method):
     cache_name = f'_cached_{method.__name__}'
     cache_commit_name = f'_cached_{method.__name__}_commit_id'
@@ -3,6 +3,8 @@ This file provides functions which are used in various places throughout the
 codebase but don't deserve to be methods of any class.
 '''
 import bs4
+import collections
+import concurrent.futures
 import io
 import datetime
 import kkroening_ffmpeg
@@ -10,6 +12,7 @@ import hashlib
 import os
 import PIL.Image
 import re
+import string
 import tempfile
 import typing
 import zipstream
@@ -18,6 +21,7 @@ from voussoirkit import bytestring
 from voussoirkit import hms
 from voussoirkit import imagetools
 from voussoirkit import pathclass
+from voussoirkit import spinal
 from voussoirkit import stringtools
 from voussoirkit import timetools
 from voussoirkit import vlogging
@@ -27,6 +31,54 @@ log = vlogging.get_logger(__name__)
 from . import constants
 from . import exceptions
 
+DIGIT_RUNS = re.compile(r'([0-9]+)')
+ASCII_LOWERCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+class LRUCache:
+    '''
+    A least-recently-used cache with the same interface as cacheclass.Cache,
+    for the caches that never expire. cacheclass.Cache timestamps every item
+    and rescans itself for expired items while inserting, which is wasted
+    work when the expiry is infinite. Here a hit is just OrderedDict.move_to_end.
+    '''
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.cache = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __getitem__(self, key):
+        # Let KeyError raise to caller.
+        value = self.cache[key]
+        self.cache.move_to_end(key)
+        return value
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __setitem__(self, key, value):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        elif len(self.cache) >= self.maxlen:
+            self.cache.popitem(last=False)
+        self.cache[key] = value
+
+    def clear(self):
+        self.cache.clear()
+
+    def get(self, key, fallback=None):
+        try:
+            return self[key]
+        except KeyError:
+            return fallback
+
+    def pop(self, key):
+        return self.cache.pop(key)
+
+    def remove(self, key):
+        self.cache.pop(key, None)
+
 def album_as_directory_map(
         album,
         naming='simplified',
@@ -188,6 +240,17 @@ def decollide_names(things, namer):
 def dict_to_tuple(d) -> tuple:
     return tuple(sorted(d.items()))
 
+def directory_range(directory) -> tuple[str, str]:
+    '''
+    Given a pathclass.Path directory, return strings (low, high) such that
+    every path beneath that directory satisfies low <= path < high, for use
+    as an indexed range in SQL. Unlike LIKE 'directory/%', this does not
+    treat _ and % in the directory name as wildcards.
+    '''
+    low = directory.absolute_path.rstrip(os.sep) + os.sep
+    high = low[:-1] + chr(ord(os.sep) + 1)
+    return (low, high)
+
 def dotdot_range(s) -> tuple:
     '''
     Given a string like '1..3', return numbers (1, 3) representing lower
@@ -309,6 +372,16 @@ def get_mimetype(extension) -> typing.Optional[str]:
     extension = extension.strip('.')
     return constants.MIMETYPES.get(extension, None)
 
+def hash_file(filepath, **kwargs) -> str:
+    '''
+    Return the sha256 hexdigest of the file. kwargs are passed into
+    spinal.hash_file, such as bytes_per_second, chunk_size, and progressbar.
+
+    hashlib.sha256 is the OpenSSL implementation, which uses the CPU's SHA
+    extensions when it has them, so we don't need to look any further.
+    '''
+    return spinal.hash_file(filepath, hash_class=hashlib.sha256, **kwargs).hexdigest()
+
 def hash_photoset(photos) -> str:
     '''
     Given some photos, return a fingerprint string for that particular set.
@@ -349,6 +422,16 @@ def make_atom_feed(objects, feed_title, feed_link, feed_id) -> bs4.BeautifulSoup
 
     return soup
 
+def natural_sort_key(s) -> list:
+    '''
+    The same ordering as stringtools.natural_sorter, so that 'file2' comes
+    before 'file10', but with the regex compiled once. digest_directory uses
+    this as the sort key for every file it walks.
+    '''
+    parts = DIGIT_RUNS.split(s)
+    # re.split with a capture group puts the digit runs at the odd indices.
+    return [int(part) if index % 2 else part.lower() for (index, part) in enumerate(parts)]
+
 def parse_unit_string(s) -> typing.Union[int, float, None]:
     '''
     Try to parse the string as an int, float, or bytestring, or hms.
@@ -478,6 +561,28 @@ def split_easybake_string(ebstring) -> tuple[str, str, str]:
     tagname = tagname.strip('.')
     return (tagname, synonym, rename_to)
 
+def sqlite_nocase(s) -> str:
+    '''
+    Return a key under which two strings are equal if SQLite's NOCASE
+    collation considers them equal. NOCASE only folds the ASCII letters, so
+    str.lower would merge names that the database keeps apart.
+    '''
+    return s.translate(ASCII_LOWERCASE)
+
+def threaded_map(function, items, max_workers=32) -> list:
+    '''
+    Return [function(item) for item in items], running up to max_workers calls
+    at a time. This is meant for functions that spend their time blocked on
+    the filesystem, like stat calls, which release the GIL while they wait.
+    '''
+    items = list(items)
+    if len(items) < 2:
+        return [function(item) for item in items]
+
+    max_workers = min(max_workers, len(items))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(function, items))
+
 def utcfromtimestamp(unix):
     return datetime.datetime.utcfromtimestamp(unix).replace(tzinfo=datetime.timezone.utc)
 
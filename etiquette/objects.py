@@ -6,11 +6,13 @@ import abc
 import bcrypt
 import bs4
 import datetime
-import hashlib
+import functools
 import os
 import PIL.Image
 import re
 import send2trash
+import stat
+import sys
 import time
 import traceback
 import typing
@@ -39,8 +41,13 @@ from . import helpers
 from . import searchhelpers
 
 BAIL = sentinel.Sentinel('BAIL')
+WHITESPACE_RUN = re.compile(r'\s+')
 
 class ObjectBase(worms.Object):
+    # Lets the PhotoDB recognize our object classes with a plain attribute
+    # lookup instead of an issubclass check on every generate_id / insert.
+    _is_object_base = True
+
     def __init__(self, photodb):
         super().__init__(photodb)
         self.photodb = photodb
@@ -128,7 +135,7 @@ class GroupableMixin(metaclass=abc.ABCMeta):
         data = {
             'parentid': self.id,
             'memberid': member.id,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
         }
         self.photodb.insert(table=self.group_table, pairs=data)
 
@@ -342,7 +349,7 @@ class Album(ObjectBase, GroupableMixin):
         data = {
             'albumid': self.id,
             'directory': path.absolute_path,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
         }
         self.photodb.insert(table='album_associated_directories', pairs=data)
 
@@ -366,8 +373,37 @@ class Album(ObjectBase, GroupableMixin):
 
         Raises ValueError if any path is not a directory.
         '''
+        paths = [pathclass.Path(path) for path in paths]
+        for path in paths:
+            if not path.is_dir:
+                raise ValueError(f'{path} is not a directory.')
+
+        # The directory column is COLLATE NOCASE, so the comparison here has
+        # to be too or we would insert duplicates that differ only in case.
+        existing = set(
+            helpers.sqlite_nocase(directory)
+            for directory in self.photodb.select_column(
+                'SELECT directory FROM album_associated_directories WHERE albumid == ?',
+                [self.id]
+            )
+        )
+        new_directories = []
         for path in paths:
-            self._add_associated_directory(path)
+            key = helpers.sqlite_nocase(path.absolute_path)
+            if key in existing:
+                continue
+            existing.add(key)
+            new_directories.append(path.absolute_path)
+
+        if not new_directories:
+            return
+
+        log.info('Adding directories %s to %s.', new_directories, self)
+        created = time.time()
+        self.photodb.executemany(
+            'INSERT INTO album_associated_directories(albumid, directory, created) VALUES(?, ?, ?)',
+            [(self.id, directory, created) for directory in new_directories]
+        )
 
     @decorators.required_feature('album.edit')
     @worms.atomic
@@ -389,7 +425,7 @@ class Album(ObjectBase, GroupableMixin):
         data = {
             'albumid': self.id,
             'photoid': photo.id,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
         }
         self.photodb.insert(table='album_photo_rel', pairs=data)
 
@@ -404,15 +440,23 @@ class Album(ObjectBase, GroupableMixin):
     @decorators.required_feature('album.edit')
     @worms.atomic
     def add_photos(self, photos) -> None:
-        existing_photos = set(self.get_photos())
-        photos = set(photos)
-        new_photos = photos.difference(existing_photos)
+        # Only the ids are needed to find which photos are new, so we can skip
+        # instantiating every photo already in the album.
+        existing_ids = set(self.photodb.select_column(
+            'SELECT photoid FROM album_photo_rel WHERE albumid == ?',
+            [self.id]
+        ))
+        new_photos = {photo.id: photo for photo in photos if photo.id not in existing_ids}
 
         if not new_photos:
             return
 
-        for photo in new_photos:
-            self._add_photo(photo)
+        log.info('Adding %d photos to %s.', len(new_photos), self)
+        created = time.time()
+        self.photodb.executemany(
+            'INSERT INTO album_photo_rel(albumid, photoid, created) VALUES(?, ?, ?)',
+            [(self.id, photo_id, created) for photo_id in new_photos]
+        )
 
     # Photo.add_tag already has @required_feature
     @worms.atomic
@@ -926,14 +970,20 @@ class Photo(ObjectBase):
         self.id = db_row['id']
         self.created_unix = db_row['created']
         self._author_id = self.normalize_author_id(db_row['author_id'])
-        self.extension = self.real_path.extension.no_dot
+        # Extensions and mimetypes have very few distinct values across all
+        # photos, so interning them saves memory on large result sets and makes
+        # comparisons faster.
+        self.extension = sys.intern(self.real_path.extension.no_dot)
         self.mtime = db_row['mtime']
-        self.sha256 = db_row['sha256']
+        # The database stores the 32 raw bytes, but everywhere else we use the
+        # hexdigest string.
+        sha256 = db_row['sha256']
+        self.sha256 = None if sha256 is None else sha256.hex()
 
         if self.extension == '':
             self.dot_extension = ''
         else:
-            self.dot_extension = '.' + self.extension
+            self.dot_extension = sys.intern('.' + self.extension)
 
         self.bytes = db_row['bytes']
         self.duration = db_row['duration']
@@ -992,8 +1042,8 @@ class Photo(ObjectBase):
             self.simple_mimetype = None
             self.mimetype = None
         else:
-            self.simple_mimetype = mime[0]
-            self.mimetype = '/'.join(mime)
+            self.simple_mimetype = sys.intern(mime[0])
+            self.mimetype = sys.intern('/'.join(mime))
 
     def _uncache(self):
         self.photodb.caches[Photo].remove(self.id)
@@ -1010,11 +1060,12 @@ class Photo(ObjectBase):
 
         log.info('Applying %s to %s.', tag, self)
 
+        now = time.time()
         data = {
             'id': self.photodb.generate_id(PhotoTagRel),
             'photoid': self.id,
             'tagid': tag.id,
-            'created': timetools.now().timestamp(),
+            'created': now,
             'timestamp': PhotoTagRel.normalize_timestamp(timestamp)
         }
         self.photodb.insert(table=PhotoTagRel, pairs=data)
@@ -1022,7 +1073,7 @@ class Photo(ObjectBase):
 
         data = {
             'id': self.id,
-            'tagged_at': timetools.now().timestamp(),
+            'tagged_at': now,
         }
         self.photodb.update(table=Photo, pairs=data, where_key='id')
 
@@ -1327,10 +1378,14 @@ class Photo(ObjectBase):
 
     @decorators.required_feature('photo.reload_metadata')
     @worms.atomic
-    def reload_metadata(self, hash_kwargs=None, trusted_file=False) -> None:
+    def reload_metadata(self, hash_kwargs=None, known_hash=None, trusted_file=False) -> None:
         '''
         Load the file's height, width, etc as appropriate for this type of file.
 
+        known_hash:
+            If the sha256 of the file was just computed by the caller, you may
+            provide it here so the file does not need to be read again.
+
         trusted_file:
             If True, we can disable certain safeguards for file parsing,
             depending on the file format.
@@ -1344,10 +1399,14 @@ class Photo(ObjectBase):
         self.height = None
         self.duration = None
 
-        if self.real_path.is_file:
-            stat = self.real_path.stat
-            self.mtime = stat.st_mtime
-            self.bytes = stat.st_size
+        # One stat call instead of is_file followed by stat.
+        try:
+            file_stat = self.real_path.stat
+        except OSError:
+            file_stat = None
+        if file_stat is not None and stat.S_ISREG(file_stat.st_mode):
+            self.mtime = file_stat.st_mtime
+            self.bytes = file_stat.st_size
 
         if self.bytes is None:
             pass
@@ -1361,14 +1420,17 @@ class Photo(ObjectBase):
         elif self.simple_mimetype == 'audio':
             self._reload_audio_metadata()
 
-        hash_kwargs = hash_kwargs or {}
-        sha256 = spinal.hash_file(self.real_path, hash_class=hashlib.sha256, **hash_kwargs)
-        self.sha256 = sha256.hexdigest()
+        if known_hash is not None:
+            self.sha256 = known_hash
+        else:
+            hash_kwargs = dict(hash_kwargs or {})
+            hash_kwargs.setdefault('chunk_size', self.photodb.config['hash_chunk_size'])
+            self.sha256 = helpers.hash_file(self.real_path, **hash_kwargs)
 
         data = {
             'id': self.id,
             'mtime': self.mtime,
-            'sha256': self.sha256,
+            'sha256': bytes.fromhex(self.sha256),
             'width': self.width,
             'height': self.height,
             'duration': self.duration,
@@ -1429,7 +1491,7 @@ class Photo(ObjectBase):
 
         data = {
             'id': self.id,
-            'tagged_at': timetools.now().timestamp(),
+            'tagged_at': time.time(),
         }
         self.photodb.update(table=Photo, pairs=data, where_key='id')
 
@@ -1452,7 +1514,7 @@ class Photo(ObjectBase):
 
         data = {
             'id': self.id,
-            'tagged_at': timetools.now().timestamp(),
+            'tagged_at': time.time(),
         }
         self.photodb.update(table=Photo, pairs=data, where_key='id')
 
@@ -1580,7 +1642,7 @@ class Photo(ObjectBase):
         pairs = {
             'photoid': self.id,
             'thumbnail': blob,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
         }
         if self.photodb.exists('SELECT 1 FROM photo_thumbnails WHERE photoid = ?', [self.id]):
             self.photodb.update(table='photo_thumbnails', pairs=pairs, where_key='photoid')
@@ -1824,11 +1886,13 @@ class Search:
         }
         return j
 
-    def _generator(self):
-        self.start_time = time.perf_counter()
-        self.generator_started = True
-        self.start_commit_id = self.photodb.last_commit_id
+    def _build_query(self):
+        '''
+        Normalize the search kwargs and build the SQL query, setting
+        self.query, self.bindings, and self.photo_filter.
 
+        Returns False if the search should not yield anything.
+        '''
         kwargs = self.kwargs
 
         maximums = {}
@@ -1932,7 +1996,7 @@ class Search:
             if self.raise_errors:
                 raise exceptions.NoYields(['yield_albums', 'yield_photos'])
             else:
-                return
+                return False
 
         photo_tag_rel_exist_clauses = searchhelpers.photo_tag_rel_exist_clauses(
             kwargs.tag_musts,
@@ -1942,6 +2006,7 @@ class Search:
 
         notnulls = set()
         yesnulls = set()
+        joins = []
         wheres = []
         bindings = []
 
@@ -1977,16 +2042,16 @@ class Search:
             wheres.append(f'extension IN {sqlhelpers.listify(extensions)} COLLATE NOCASE')
 
         if kwargs.within_directory:
-            patterns = {d.absolute_path.rstrip(os.sep) for d in kwargs.within_directory}
-            patterns = {f'{d}{os.sep}%' for d in patterns}
-            clauses = ['filepath LIKE ?'] * len(patterns)
+            ranges = {helpers.directory_range(d) for d in kwargs.within_directory}
+            clauses = ['(filepath >= ? AND filepath < ?)'] * len(ranges)
             if len(clauses) > 1:
                 clauses = ' OR '.join(clauses)
                 clauses = f'({clauses})'
             else:
                 clauses = clauses.pop()
             wheres.append(clauses)
-            bindings.extend(patterns)
+            for (low, high) in ranges:
+                bindings.extend([low, high])
 
         if kwargs.has_albums is True or (kwargs.yield_albums and not kwargs.yield_photos):
             wheres.append('EXISTS (SELECT 1 FROM album_photo_rel WHERE photoid == photos.id)')
@@ -1994,7 +2059,9 @@ class Search:
             wheres.append('NOT EXISTS (SELECT 1 FROM album_photo_rel WHERE photoid == photos.id)')
 
         if kwargs.has_tags is True:
-            wheres.append('EXISTS (SELECT 1 FROM photo_tag_rel WHERE photoid == photos.id)')
+            # The planner handles this join against the photoid index better
+            # than a correlated EXISTS evaluated for every photo.
+            joins.append('INNER JOIN (SELECT DISTINCT photoid FROM photo_tag_rel) AS t_has ON t_has.photoid == photos.id')
         elif kwargs.has_tags is False:
             wheres.append('NOT EXISTS (SELECT 1 FROM photo_tag_rel WHERE photoid == photos.id)')
 
@@ -2013,7 +2080,9 @@ class Search:
             wheres.append('searchhidden == 0')
 
         if kwargs.sha256:
-            wheres.append(f'sha256 IN {sqlhelpers.listify(kwargs.sha256)}')
+            qmarks = ', '.join('?' * len(kwargs.sha256))
+            wheres.append(f'sha256 IN ({qmarks})')
+            bindings.extend(bytes.fromhex(sha) for sha in kwargs.sha256)
 
         for column in notnulls:
             wheres.append(column + ' IS NOT NULL')
@@ -2026,7 +2095,8 @@ class Search:
         for (column, value) in maximums.items():
             wheres.append(column + ' <= ' + str(value))
 
-        query = ['SELECT * FROM photos']
+        query = ['SELECT photos.* FROM photos']
+        query.extend(joins)
 
         if wheres:
             wheres = 'WHERE ' + ' AND '.join(wheres)
@@ -2038,31 +2108,56 @@ class Search:
             orderby = 'ORDER BY ' + orderby
             query.append(orderby)
 
+        # Without a photo filter, every row is a result, so SQLite can apply
+        # the offset and limit instead of us reading and discarding rows.
+        self.needs_photo_filter = bool(filename_tree or tag_expression_tree)
+        self.python_offset = kwargs.offset
+        if not self.needs_photo_filter:
+            if kwargs.limit is not None and not kwargs.yield_albums:
+                # One extra row so that more_after_limit can still be known.
+                query.append('LIMIT ?')
+                bindings.append(kwargs.limit + 1)
+            elif kwargs.offset:
+                query.append('LIMIT -1')
+
+            if kwargs.offset:
+                query.append('OFFSET ?')
+                bindings.append(kwargs.offset)
+                self.python_offset = 0
+
         query = ' '.join(query)
 
         self.query = query
         self.bindings = bindings
         self.explain = self.photodb.explain(query, bindings)
-
         log.loud(self.explain)
+
+        self.photo_filter = searchhelpers.photo_filter_builder(
+            filename_tree=filename_tree or None,
+            tag_expression_tree=tag_expression_tree,
+            tag_match_function=tag_match_function if tag_expression_tree else None,
+        )
+        return True
+
+    def _generator(self):
+        self.start_time = time.perf_counter()
+        self.generator_started = True
+        self.start_commit_id = self.photodb.last_commit_id
+
+        if not self._build_query():
+            return
+
+        kwargs = self.kwargs
+        photo_filter = self.photo_filter
         generator = self.photodb.select(self.query, self.bindings)
         seen_albums = set()
-        offset = kwargs.offset
+        offset = self.python_offset
         for row in generator:
             photo = self.photodb.get_cached_instance(Photo, row)
 
-            if filename_tree and not filename_tree.evaluate(photo.basename.lower()):
+            if not photo_filter(photo):
                 continue
 
-            if tag_expression_tree:
-                photo_tags = set(photo.get_tags())
-                success = tag_expression_tree.evaluate(
-                    photo_tags,
-                    match_function=tag_match_function,
-                )
-                if not success:
-                    continue
-
             if offset > 0:
                 offset -= 1
                 continue
@@ -2091,6 +2186,75 @@ class Search:
         self.end_time = time.perf_counter()
         log.debug('Search took %s.', self.end_time - self.start_time)
 
+    def columns(self, columns):
+        '''
+        Return the matching photos as a dictionary of {column: [values]}
+        without constructing Photo objects, for callers that only need a few
+        fields of each result. Albums are never included, regardless of
+        yield_albums.
+
+        If the search uses a filename or tag expression, those checks require
+        Photo objects and will still be performed for each row.
+        '''
+        if isinstance(columns, str):
+            columns = [columns]
+        columns = list(columns)
+
+        bad = [column for column in columns if column not in self.photodb.COLUMN_INDEX['photos']]
+        if bad:
+            raise ValueError(f'Invalid photos columns {bad}.')
+
+        self.start_time = time.perf_counter()
+        self.generator_started = True
+        self.start_commit_id = self.photodb.last_commit_id
+
+        results = {column: [] for column in columns}
+        if not self._build_query():
+            return results
+
+        kwargs = self.kwargs
+        if self.needs_photo_filter:
+            query = self.query
+        else:
+            select = ', '.join(f'photos.{column}' for column in columns)
+            query = self.query.replace('SELECT photos.*', f'SELECT {select}', 1)
+
+        offset = self.python_offset
+        generator = self.photodb.select(query, self.bindings)
+        for row in generator:
+            if self.needs_photo_filter:
+                photo = self.photodb.get_cached_instance(Photo, row)
+                if not self.photo_filter(photo):
+                    continue
+
+            if offset > 0:
+                offset -= 1
+                continue
+
+            for column in columns:
+                results[column].append(row[column])
+            self.results_received += 1
+
+            if kwargs.limit is not None and self.results_received >= kwargs.limit:
+                break
+
+        try:
+            next(generator)
+        except StopIteration:
+            self.more_after_limit = False
+        else:
+            self.more_after_limit = True
+
+        if 'sha256' in results:
+            # The column holds the digest bytes, but everywhere else the API
+            # deals in hexdigest strings, as in Photo.sha256.
+            results['sha256'] = [None if sha256 is None else sha256.hex() for sha256 in results['sha256']]
+
+        self.generator_exhausted = True
+        self.end_time = time.perf_counter()
+        log.debug('Search took %s.', self.end_time - self.start_time)
+        return results
+
 class Tag(ObjectBase, GroupableMixin):
     '''
     A Tag, which can be applied to Photos for organization.
@@ -2139,12 +2303,17 @@ class Tag(ObjectBase, GroupableMixin):
         return description
 
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def normalize_name(name, min_length=None, max_length=None) -> str:
         '''
         Raises exceptions.TagTooShort if shorter than min_length.
 
         Raises exceptions.TagTooLong if longer than max_length after invalid
         characters are removed.
+
+        The results are memoized because easybake and bulk tagging normalize
+        the same names over and over. The length limits are part of the cache
+        key, so a config reload with new limits can't get stale results.
         '''
         original_name = name
         # if valid_chars is None:
@@ -2152,7 +2321,7 @@ class Tag(ObjectBase, GroupableMixin):
 
         name = name.lower()
         name = stringtools.remove_control_characters(name)
-        name = re.sub(r'\s+', ' ', name)
+        name = WHITESPACE_RUN.sub(' ', name)
         name = name.strip(' .+')
         name = name.split('+')[0].split('.')[-1]
         name = name.replace('-', '_')
@@ -2216,11 +2385,12 @@ class Tag(ObjectBase, GroupableMixin):
         log.info('New synonym %s of %s.', synname, self.name)
 
         self.photodb.caches['tag_exports'].clear()
+        self.photodb.caches['tag_by_name'].clear()
 
         data = {
             'name': synname,
             'mastername': self.name,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
         }
         self.photodb.insert(table='tag_synonyms', pairs=data)
 
@@ -2243,6 +2413,7 @@ class Tag(ObjectBase, GroupableMixin):
         mastertag = self.photodb.get_tag(name=mastertag)
 
         self.photodb.caches['tag_exports'].clear()
+        self.photodb.caches['tag_by_name'].clear()
 
         # Migrate the old tag's synonyms to the new one
         # UPDATE is safe for this operation because there is no chance of duplicates.
@@ -2300,6 +2471,7 @@ class Tag(ObjectBase, GroupableMixin):
         self.photodb.delete(table='tag_synonyms', pairs={'mastername': self.name})
         self.photodb.delete(table=Tag, pairs={'id': self.id})
         self.photodb.caches['tag_exports'].clear()
+        self.photodb.caches['tag_by_name'].clear()
         self._uncache()
         self.deleted = True
 
@@ -2405,6 +2577,7 @@ class Tag(ObjectBase, GroupableMixin):
             raise exceptions.NoSuchSynonym(synname)
 
         self.photodb.caches['tag_exports'].clear()
+        self.photodb.caches['tag_by_name'].clear()
         self.photodb.delete(table='tag_synonyms', pairs={'name': synname})
         if self._cached_synonyms is not None:
             self._cached_synonyms.remove(synname)
@@ -2435,6 +2608,7 @@ class Tag(ObjectBase, GroupableMixin):
             raise exceptions.TagExists(new_name)
 
         self.photodb.caches['tag_exports'].clear()
+        self.photodb.caches['tag_by_name'].clear()
 
         data = {
             'id': self.id,
@@ -2649,11 +2823,7 @@ class User(ObjectBase):
     @decorators.required_feature('user.edit')
     @worms.atomic
     def set_password(self, password) -> None:
-        if not isinstance(password, bytes):
-            password = password.encode('utf-8')
-
-        self.photodb.assert_valid_password(password)
-        hashed_password = bcrypt.hashpw(password, bcrypt.gensalt())
+        hashed_password = self.photodb.hash_password(password)
 
         data = {
             'id': self.id,
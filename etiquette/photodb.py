@@ -1,9 +1,17 @@
 import bcrypt
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
 import hashlib
 import json
 import os
-import random
+import queue
+import sqlite3
 import tempfile
+import threading
+import time
 import types
 import typing
 
@@ -16,19 +24,72 @@ from . import tag_export
 
 from voussoirkit import cacheclass
 from voussoirkit import configlayers
+from voussoirkit import gentools
 from voussoirkit import pathclass
 from voussoirkit import progressbars
 from voussoirkit import ratelimiter
 from voussoirkit import spinal
-from voussoirkit import sqlhelpers
-from voussoirkit import stringtools
-from voussoirkit import timetools
 from voussoirkit import vlogging
 from voussoirkit import worms
 
 log = vlogging.getLogger(__name__)
 
-RNG = random.SystemRandom()
+# These queries are run very frequently, so they are kept as constants. The
+# sqlite3 statement cache is keyed by the query string, so reusing the exact
+# same string lets SQLite skip re-parsing them.
+SQL_PHOTO_BY_PATH = 'SELECT * FROM photos WHERE filepath == ?'
+SQL_PHOTOS_BY_HASH = 'SELECT * FROM photos WHERE sha256 == ?'
+SQL_USER_BY_USERNAME = 'SELECT * FROM users WHERE username == ?'
+# Follow the synonym chain from the given name until we land on a toplevel
+# tag. The depth limit guards against cyclic synonym data.
+SQL_TAG_BY_NAME = '''
+WITH RECURSIVE resolve(name, depth) AS (
+    SELECT ?, 0
+    UNION ALL
+    SELECT tag_synonyms.mastername, resolve.depth + 1
+    FROM tag_synonyms JOIN resolve ON tag_synonyms.name == resolve.name
+    WHERE resolve.depth < 32
+)
+SELECT tags.* FROM tags JOIN resolve ON tags.name == resolve.name
+ORDER BY resolve.depth LIMIT 1
+'''.strip()
+
+def _root_objects_query(object_class):
+    return f'''
+    SELECT * FROM {object_class.table}
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {object_class.group_table}
+        WHERE memberid == {object_class.table}.id
+    )
+    '''
+
+SQL_ROOT_OBJECTS = {
+    object_class: _root_objects_query(object_class)
+    for object_class in [objects.Album, objects.Tag]
+}
+
+@functools.lru_cache(maxsize=4096)
+def _absolute_path_cached(path):
+    return pathclass.Path(path).absolute_path
+
+def _absolute_path(path) -> str:
+    '''
+    Return the absolute_path of the given str or Path, as the path lookups
+    bind it. Building a Path from a string costs an abspath and splitting the
+    parts, which adds up when digest looks up every file, so absolute strings
+    are cached. Relative strings depend on the cwd and are never cached.
+    '''
+    if isinstance(path, pathclass.Path):
+        return path.absolute_path
+    if isinstance(path, str) and os.path.isabs(path):
+        return _absolute_path_cached(path)
+    return pathclass.Path(path).absolute_path
+
+# The default of 128 is easily exhausted by the variety of queries built
+# during searches and digests. Batched selects produce a different statement
+# for every batch size up to 999, and those should not push the hot queries
+# out of the cache.
+SQLITE_CACHED_STATEMENTS = 1024
 
 ####################################################################################################
 
@@ -53,12 +114,34 @@ class PDBAlbumMixin:
         Yield Albums with the `associated_directory` of this value,
         NOT case-sensitive.
         '''
-        directory = pathclass.Path(directory)
         query = 'SELECT albumid FROM album_associated_directories WHERE directory == ?'
-        bindings = [directory.absolute_path]
+        bindings = [_absolute_path(directory)]
         album_ids = self.select_column(query, bindings)
         return self.get_albums_by_id(album_ids)
 
+    def get_albums_by_paths(self, directories) -> dict:
+        '''
+        Return a dictionary of {absolute_path: [Albums]} for each of the given
+        directories which has at least one Album with that associated_directory,
+        NOT case-sensitive. The dictionary keys are lowercased.
+
+        This is better than calling get_albums_by_path in a loop because we
+        can use a single SQL select to get batches of up to 999 directories.
+        '''
+        directories = {_absolute_path(d) for d in directories}
+        query = 'SELECT directory, albumid FROM album_associated_directories WHERE directory IN ({qmarks})'
+        album_ids_by_path = {}
+        for (directory, album_id) in self._select_in(query, directories):
+            album_ids_by_path.setdefault(directory.lower(), []).append(album_id)
+
+        all_ids = {album_id for album_ids in album_ids_by_path.values() for album_id in album_ids}
+        albums = {album.id: album for album in self.get_albums_by_id(all_ids)}
+        albums_by_path = {
+            directory: [albums[album_id] for album_id in album_ids if album_id in albums]
+            for (directory, album_ids) in album_ids_by_path.items()
+        }
+        return albums_by_path
+
     def get_albums_by_sql(self, query, bindings=None) -> typing.Iterable[objects.Album]:
         return self.get_objects_by_sql(objects.Album, query, bindings)
 
@@ -69,11 +152,9 @@ class PDBAlbumMixin:
         # I'd like to find a better solution than this separate method.
         directory = pathclass.Path(directory)
         directory.assert_is_directory()
-        pattern = directory.absolute_path.rstrip(os.sep)
-        pattern = f'{pattern}{os.sep}%'
         album_ids = self.select_column(
-            'SELECT DISTINCT albumid FROM album_associated_directories WHERE directory LIKE ?',
-            [pattern]
+            'SELECT DISTINCT albumid FROM album_associated_directories WHERE directory >= ? AND directory < ?',
+            helpers.directory_range(directory)
         )
         albums = self.get_albums_by_id(album_ids)
         return albums
@@ -111,7 +192,7 @@ class PDBAlbumMixin:
             'id': album_id,
             'title': title,
             'description': description,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
             'thumbnail_photo': None,
             'author_id': author_id,
         }
@@ -125,44 +206,98 @@ class PDBAlbumMixin:
         album.add_associated_directories(associated_directories)
 
         if photos is not None:
-            photos = [self.get_photo(photo) for photo in photos]
+            photo_ids = [photo.id if isinstance(photo, objects.Photo) else photo for photo in photos]
+            photos = list(self.get_objects_by_id(objects.Photo, photo_ids, raise_for_missing=True))
             album.add_photos(photos)
 
         return album
 
-    @worms.atomic
+    @decorators.atomic_generator
     def purge_deleted_associated_directories(self, albums=None) -> typing.Iterable[pathclass.Path]:
-        query = 'SELECT DISTINCT directory FROM album_associated_directories'
-        directories = self.select_column(query)
-        directories = (pathclass.Path(d) for d in directories)
-        directories = [d for d in directories if not d.is_dir]
+        if albums is None:
+            query = 'SELECT albumid, directory FROM album_associated_directories'
+            rows = list(self.select(query))
+        else:
+            album_ids = {album.id for album in albums}
+            query = 'SELECT albumid, directory FROM album_associated_directories WHERE albumid IN ({qmarks})'
+            rows = list(self._select_in(query, album_ids))
+
+        directories = list({directory for (album_id, directory) in rows})
+        directories = [pathclass.Path(d) for d in directories]
+        # Each is_dir is a stat which may be slow on network drives, so we
+        # check them in parallel.
+        is_dirs = helpers.threaded_map(lambda d: d.is_dir, directories)
+        directories = [d for (d, is_dir) in zip(directories, is_dirs) if not is_dir]
         if not directories:
             return
         log.info('Purging associated directories %s.', directories)
 
-        d_query = sqlhelpers.listify(d.absolute_path for d in directories)
-        query = f'DELETE FROM album_associated_directories WHERE directory in {d_query}'
-        if albums is not None:
-            album_ids = sqlhelpers.listify(a.id for a in albums)
-            query += f' AND albumid IN {album_ids}'
-        self.execute(query)
+        deleted = {d.absolute_path for d in directories}
+        self.executemany(
+            'DELETE FROM album_associated_directories WHERE albumid == ? AND directory == ?',
+            [(album_id, directory) for (album_id, directory) in rows if directory in deleted]
+        )
         yield from directories
 
-    @worms.atomic
+    @decorators.atomic_generator
     def purge_empty_albums(self, albums=None) -> typing.Iterable[objects.Album]:
-        if albums is None:
-            to_check = set(self.get_albums())
-        else:
-            to_check = set()
-            for album in albums:
-                to_check.update(album.walk_children())
+        '''
+        Delete Albums which contain no photos, either directly or through any
+        of their descendants.
 
-        while to_check:
-            album = to_check.pop()
-            if album.get_children() or album.get_photos():
-                continue
-            # This may have been the last child of an otherwise empty parent.
-            to_check.update(album.get_parents())
+        albums:
+            If provided, only these albums and their descendants are checked,
+            along with any ancestors which are left without children by the
+            purge. Otherwise, all albums are checked.
+        '''
+        # An album is non-empty if it has photos or if any of its children is
+        # non-empty, so we can build that set upwards from album_photo_rel in
+        # one query. Everything else is empty.
+        query = '''
+        WITH RECURSIVE nonempty(id) AS (
+            SELECT albumid FROM album_photo_rel
+            UNION
+            SELECT album_group_rel.parentid FROM album_group_rel
+            JOIN nonempty ON album_group_rel.memberid == nonempty.id
+        )
+        SELECT id FROM albums WHERE id NOT IN nonempty
+        '''
+        empty_ids = set(self.select_column(query))
+
+        if albums is not None:
+            # Every empty album beneath the given albums gets deleted.
+            album_ids = {album.id for album in albums}
+            query = '''
+            WITH RECURSIVE down(id) AS (
+                SELECT id FROM albums WHERE id IN ({qmarks})
+                UNION
+                SELECT memberid FROM album_group_rel JOIN down ON parentid == down.id
+            )
+            SELECT id FROM down
+            '''
+            descendants = {album_id for (album_id,) in self._select_in(query, album_ids)}
+            deleting = empty_ids.intersection(descendants)
+
+            # An ancestor is only deleted once all of its children are, as if
+            # it had become empty by losing its last child. An empty ancestor
+            # which still has other children stays.
+            newly_deleted = deleting
+            while newly_deleted:
+                query = 'SELECT parentid FROM album_group_rel WHERE memberid IN ({qmarks})'
+                parent_ids = {parentid for (parentid,) in self._select_in(query, newly_deleted)}
+                parent_ids = parent_ids.intersection(empty_ids).difference(deleting)
+                query = 'SELECT parentid, memberid FROM album_group_rel WHERE parentid IN ({qmarks})'
+                children = {}
+                for (parentid, memberid) in self._select_in(query, parent_ids):
+                    children.setdefault(parentid, set()).add(memberid)
+                newly_deleted = {
+                    parent_id for parent_id in parent_ids
+                    if children[parent_id].issubset(deleting)
+                }
+                deleting.update(newly_deleted)
+            empty_ids = deleting
+
+        for album in list(self.get_albums_by_id(empty_ids)):
             album.delete()
             yield album
 
@@ -203,7 +338,7 @@ class PDBBookmarkMixin:
             'id': bookmark_id,
             'title': title,
             'url': url,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
             'author_id': author_id,
         }
         self.insert(table=objects.Bookmark, pairs=data)
@@ -222,21 +357,13 @@ class PDBGroupableMixin:
         '''
         For Groupable types, yield objects which have no parent.
         '''
-        object_table = object_class.table
-        group_table = object_class.group_table
-
-        query = f'''
-        SELECT * FROM {object_table}
-        WHERE NOT EXISTS (
-            SELECT 1 FROM {group_table}
-            WHERE memberid == {object_table}.id
-        )
-        '''
+        query = SQL_ROOT_OBJECTS.get(object_class, None)
+        if query is None:
+            query = _root_objects_query(object_class)
 
-        rows = self.select(query)
-        for row in rows:
-            instance = self.get_cached_instance(object_class, row)
-            yield instance
+        get_cached_instance = self.get_cached_instance
+        for row in self.select(query):
+            yield get_cached_instance(object_class, row)
 
 ####################################################################################################
 
@@ -256,12 +383,9 @@ class PDBPhotoMixin:
         return self.get_object_by_id(objects.Photo, id)
 
     def get_photo_by_path(self, filepath) -> objects.Photo:
-        filepath = pathclass.Path(filepath)
-        query = 'SELECT * FROM photos WHERE filepath == ?'
-        bindings = [filepath.absolute_path]
-        photo_row = self.select_one(query, bindings)
+        photo_row = self.select_one(SQL_PHOTO_BY_PATH, [_absolute_path(filepath)])
         if photo_row is None:
-            raise exceptions.NoSuchPhoto(filepath)
+            raise exceptions.NoSuchPhoto(pathclass.Path(filepath))
         photo = self.get_cached_instance(objects.Photo, photo_row)
         return photo
 
@@ -274,6 +398,19 @@ class PDBPhotoMixin:
     def get_photos_by_id(self, ids) -> typing.Iterable[objects.Photo]:
         return self.get_objects_by_id(objects.Photo, ids)
 
+    def get_photos_by_paths(self, filepaths) -> typing.Iterable[objects.Photo]:
+        '''
+        Yield the Photos for each of the given filepaths that exist in the
+        database. Filepaths which have no Photo are skipped.
+
+        This is better than calling get_photo_by_path in a loop because we can
+        use a single SQL select to get batches of up to 999 filepaths.
+        '''
+        filepaths = {_absolute_path(filepath) for filepath in filepaths}
+        query = 'SELECT * FROM photos WHERE filepath IN ({qmarks})'
+        for photo_row in self._select_in(query, filepaths):
+            yield self.get_cached_instance(objects.Photo, photo_row)
+
     def get_photos_by_recent(self, count=None) -> typing.Iterable[objects.Photo]:
         '''
         Yield photo objects in order of creation time.
@@ -281,29 +418,133 @@ class PDBPhotoMixin:
         if count is not None and count <= 0:
             return
 
-        query = 'SELECT * FROM photos ORDER BY created DESC'
-        photo_rows = self.select(query)
-        for photo_row in photo_rows:
-            photo = self.get_cached_instance(objects.Photo, photo_row)
+        # index_photos_created lets SQLite walk the newest photos in order
+        # and stop after `count` rows rather than sorting the whole table.
+        if count is None:
+            query = 'SELECT * FROM photos ORDER BY created DESC'
+            bindings = []
+        else:
+            query = 'SELECT * FROM photos ORDER BY created DESC LIMIT ?'
+            bindings = [count]
+
+        get_cached_instance = self.get_cached_instance
+        photo_class = objects.Photo
+        for photo_row in self.select(query, bindings):
+            photo = get_cached_instance(photo_class, photo_row)
             yield photo
 
-            if count is None:
-                continue
-            count -= 1
-            if count <= 0:
-                break
+    @staticmethod
+    def _sha256_binding(sha256) -> bytes:
+        '''
+        Given the 64-character hexdigest string or the 32-byte digest, return
+        the bytes as stored in the sha256 column.
+        '''
+        if isinstance(sha256, str) and len(sha256) == 64:
+            return bytes.fromhex(sha256)
+        elif isinstance(sha256, bytes) and len(sha256) == 32:
+            return sha256
+        raise TypeError('sha256 should be the 64-character hexdigest string or 32-byte digest.')
 
     def get_photos_by_hash(self, sha256) -> typing.Iterable[objects.Photo]:
-        if not isinstance(sha256, str) or len(sha256) != 64:
-            raise TypeError(f'sha256 shoulbe the 64-character hexdigest string.')
+        '''
+        sha256:
+            The 64-character hexdigest string or the 32-byte digest.
+        '''
+        sha256 = self._sha256_binding(sha256)
+        yield from self.get_photos_by_sql(SQL_PHOTOS_BY_HASH, [sha256])
 
-        query = 'SELECT * FROM photos WHERE sha256 == ?'
-        bindings = [sha256]
-        yield from self.get_photos_by_sql(query, bindings)
+    def get_photos_by_hashes(self, sha256s) -> typing.Iterable[objects.Photo]:
+        '''
+        Yield the Photos matching any of the given hashes, each of which may
+        be a hexdigest string or digest bytes.
+
+        This is better than calling get_photos_by_hash in a loop because we can
+        use a single SQL select to get batches of up to 999 hashes.
+        '''
+        sha256s = {self._sha256_binding(sha256) for sha256 in sha256s}
+        query = 'SELECT * FROM photos WHERE sha256 IN ({qmarks})'
+        for photo_row in self._select_in(query, sha256s):
+            yield self.get_cached_instance(objects.Photo, photo_row)
 
     def get_photos_by_sql(self, query, bindings=None) -> typing.Iterable[objects.Photo]:
         return self.get_objects_by_sql(objects.Photo, query, bindings)
 
+    def _new_photo_data(self, filepath, *, author_id, known_hash, searchhidden) -> dict:
+        '''
+        Validate the inputs for a new photo and return the row to be inserted.
+        The caller is responsible for making sure no Photo exists at this
+        filepath.
+        '''
+        # These might raise exceptions
+        if not filepath.is_file:
+            raise FileNotFoundError(filepath.absolute_path)
+
+        if known_hash is None:
+            pass
+        elif not isinstance(known_hash, str) or len(known_hash) != 64:
+            raise TypeError(f'known_hash should be the 64-character sha256 hexdigest string.')
+
+        # Ok.
+        photo_id = self.generate_id(objects.Photo)
+        log.info('New Photo: %s %s.', photo_id, filepath.absolute_path)
+
+        data = {
+            'id': photo_id,
+            'filepath': filepath.absolute_path,
+            'override_filename': None,
+            'created': time.time(),
+            'tagged_at': None,
+            'author_id': author_id,
+            'searchhidden': searchhidden,
+            # These will be filled in during the metadata stage.
+            'mtime': None,
+            'sha256': None if known_hash is None else bytes.fromhex(known_hash),
+            'bytes': None,
+            'width': None,
+            'height': None,
+            'duration': None,
+        }
+        return data
+
+    def _photo_from_new_data(self, data):
+        '''
+        Build the Photo for a row we just inserted, without selecting it back.
+        Photo also reads the generated columns, so we fill those in the way
+        the schema would for a new row. Only basename has a value before the
+        metadata is loaded.
+        '''
+        row = dict(data)
+        # The basename column splits on either kind of slash.
+        row['basename'] = data['filepath'].replace('\\', '/').rsplit('/', 1)[-1]
+        row['area'] = None
+        row['aspectratio'] = None
+        row['bitrate'] = None
+        return self.get_cached_instance(objects.Photo, row)
+
+    def _finish_new_photo(
+            self,
+            photo,
+            *,
+            do_metadata,
+            do_thumbnail,
+            hash_kwargs,
+            known_hash,
+            tags,
+            trusted_file,
+        ) -> None:
+        if do_metadata:
+            hash_kwargs = hash_kwargs or {}
+            photo.reload_metadata(
+                hash_kwargs=hash_kwargs,
+                known_hash=known_hash,
+                trusted_file=trusted_file,
+            )
+        if do_thumbnail:
+            photo.generate_thumbnail(trusted_file=trusted_file)
+
+        for tag in tags:
+            photo.add_tag(tag)
+
     @decorators.required_feature('photo.new')
     @worms.atomic
     def new_photo(
@@ -337,56 +578,125 @@ class PDBPhotoMixin:
         '''
         # These might raise exceptions
         filepath = pathclass.Path(filepath)
-        if not filepath.is_file:
-            raise FileNotFoundError(filepath.absolute_path)
-
         self.assert_no_such_photo_by_path(filepath=filepath)
-
         author_id = self.get_user_id_or_none(author)
-
-        if known_hash is None:
-            pass
-        elif not isinstance(known_hash, str) or len(known_hash) != 64:
-            raise TypeError(f'known_hash should be the 64-character sha256 hexdigest string.')
+        data = self._new_photo_data(
+            filepath,
+            author_id=author_id,
+            known_hash=known_hash,
+            searchhidden=searchhidden,
+        )
+        tags = tags or []
+        tags = self._get_tags_in_order(tags)
 
         # Ok.
-        photo_id = self.generate_id(objects.Photo)
-        log.info('New Photo: %s %s.', photo_id, filepath.absolute_path)
-
-        data = {
-            'id': photo_id,
-            'filepath': filepath.absolute_path,
-            'override_filename': None,
-            'created': timetools.now().timestamp(),
-            'tagged_at': None,
-            'author_id': author_id,
-            'searchhidden': searchhidden,
-            # These will be filled in during the metadata stage.
-            'mtime': None,
-            'sha256': known_hash,
-            'bytes': None,
-            'width': None,
-            'height': None,
-            'duration': None,
-        }
         self.insert(table=objects.Photo, pairs=data)
 
-        photo = self.get_photo(photo_id)
+        photo = self._photo_from_new_data(data)
+        self._finish_new_photo(
+            photo,
+            do_metadata=do_metadata,
+            do_thumbnail=do_thumbnail,
+            hash_kwargs=hash_kwargs,
+            known_hash=known_hash,
+            tags=tags,
+            trusted_file=trusted_file,
+        )
+        return photo
 
-        if do_metadata:
-            hash_kwargs = hash_kwargs or {}
-            photo.reload_metadata(hash_kwargs=hash_kwargs, trusted_file=trusted_file)
-        if do_thumbnail:
-            photo.generate_thumbnail(trusted_file=trusted_file)
+    @decorators.required_feature('photo.new')
+    @worms.atomic
+    def new_photos(
+            self,
+            filepaths,
+            *,
+            author=None,
+            do_metadata=True,
+            do_thumbnail=True,
+            hash_kwargs=None,
+            known_hashes=None,
+            searchhidden=False,
+            tags=None,
+            trusted_file=False,
+        ) -> list:
+        '''
+        Create many Photos at once. The rows are inserted with a single
+        executemany, after which each photo's metadata and thumbnail are
+        loaded as in new_photo.
+
+        known_hashes:
+            A dictionary of {filepath: sha256} for any of the files whose hash
+            is already known. See new_photo's known_hash.
+
+        Returns a list of the Photo objects in the same order as filepaths.
+        '''
+        # These might raise exceptions
+        filepaths = [pathclass.Path(filepath) for filepath in filepaths]
+        if not filepaths:
+            return []
+
+        existing = next(iter(self.get_photos_by_paths(filepaths)), None)
+        if existing is not None:
+            raise exceptions.PhotoExists(existing)
+
+        author_id = self.get_user_id_or_none(author)
+        known_hashes = known_hashes or {}
+        known_hashes = {pathclass.Path(k): v for (k, v) in known_hashes.items()}
+        datas = [
+            self._new_photo_data(
+                filepath,
+                author_id=author_id,
+                known_hash=known_hashes.get(filepath, None),
+                searchhidden=searchhidden,
+            )
+            for filepath in filepaths
+        ]
 
         tags = tags or []
-        tags = [self.get_tag(name=tag) for tag in tags]
-        for tag in tags:
-            photo.add_tag(tag)
+        tags = self._get_tags_in_order(tags)
 
-        return photo
+        # Ok.
+        columns = list(datas[0].keys())
+        qmarks = ', '.join('?' * len(columns))
+        query = f'INSERT INTO photos({", ".join(columns)}) VALUES({qmarks})'
+        for retry in range(10):
+            # generate_id does not check the table, so if any id is taken,
+            # either by an existing photo or another row of this batch, we undo
+            # the partial insert and try again with new ids.
+            savepoint_id = self.savepoint(message='new_photos')
+            try:
+                self.executemany(query, [[data[column] for column in columns] for data in datas])
+            except sqlite3.IntegrityError as exc:
+                self.rollback(savepoint=savepoint_id)
+                if not self._is_id_collision(exc, objects.Photo.table):
+                    raise
+                # This is the rare path, so we can afford to look up which ids
+                # were taken and only replace those.
+                taken = {photo.id for photo in self.get_photos_by_id(data['id'] for data in datas)}
+                for data in datas:
+                    if data['id'] in taken:
+                        data['id'] = self.generate_id(objects.Photo)
+                    taken.add(data['id'])
+                continue
+            self.release_savepoint(savepoint=savepoint_id)
+            break
+        else:
+            raise exceptions.GenerateIDFailed(table=objects.Photo.table)
+
+        photos = [self._photo_from_new_data(data) for data in datas]
+        for (filepath, photo) in zip(filepaths, photos):
+            self._finish_new_photo(
+                photo,
+                do_metadata=do_metadata,
+                do_thumbnail=do_thumbnail,
+                hash_kwargs=hash_kwargs,
+                known_hash=known_hashes.get(filepath, None),
+                tags=tags,
+                trusted_file=trusted_file,
+            )
+        return photos
 
-    @worms.atomic
+    @decorators.atomic_generator
     def purge_deleted_files(self, photos=None) -> typing.Iterable[objects.Photo]:
         '''
         Delete Photos whose corresponding file on disk is missing.
@@ -401,15 +711,29 @@ class PDBPhotoMixin:
         if photos is None:
             photos = self.get_photos_by_recent()
 
-        for photo in photos:
-            if photo.real_path.exists:
-                continue
-            photo.delete()
-            yield photo
+        # Each exists is a stat which may be slow on network drives, so we
+        # check them in parallel, a chunk at a time.
+        for chunk in gentools.chunk_generator(photos, 256):
+            exists = helpers.threaded_map(lambda photo: photo.real_path.exists, chunk)
+            for (photo, exist) in zip(chunk, exists):
+                if exist:
+                    continue
+                photo.delete()
+                yield photo
 
     def search(self, **kwargs):
         return objects.Search(photodb=self, kwargs=kwargs)
 
+    def search_columns(self, columns=('id', 'filepath'), **kwargs) -> dict:
+        '''
+        Perform a search and return {column: [values]} for the matching
+        photos, without instantiating Photo objects.
+        See objects.Search for the search kwargs. Only photos are returned, so
+        yield_photos defaults to True.
+        '''
+        kwargs.setdefault('yield_photos', True)
+        return objects.Search(photodb=self, kwargs=kwargs).columns(columns)
+
 ####################################################################################################
 
 class PDBTagMixin:
@@ -426,13 +750,15 @@ class PDBTagMixin:
 
     def _get_all_tag_names(self):
         query = 'SELECT name FROM tags'
-        names = set(self.select_column(query))
+        names = frozenset(self.select_column(query))
         return names
 
-    def get_all_tag_names(self) -> set[str]:
+    def get_all_tag_names(self) -> frozenset[str]:
         '''
-        Return a set containing the names of all tags as strings.
+        Return a frozenset containing the names of all tags as strings.
         Useful for when you don't want the overhead of actual Tag objects.
+
+        The same frozenset is shared by every caller until the tags change.
         '''
         return self.get_cached_tag_export(self._get_all_tag_names)
 
@@ -440,29 +766,56 @@ class PDBTagMixin:
         query = 'SELECT name, mastername FROM tag_synonyms'
         syn_rows = self.select(query)
         synonyms = {syn: tag for (syn, tag) in syn_rows}
-        return synonyms
+        return types.MappingProxyType(synonyms)
 
-    def get_all_synonyms(self) -> dict:
+    def get_all_synonyms(self) -> types.MappingProxyType:
         '''
-        Return a dict mapping {synonym: mastertag} as strings.
+        Return a read-only mapping of {synonym: mastertag} as strings.
+
+        The same mapping is shared by every caller until the tags change, so
+        it is read-only. Use dict() on it if you need a copy you can modify.
         '''
         return self.get_cached_tag_export(self._get_all_synonyms)
 
     def get_cached_tag_export(self, function, **kwargs):
+        '''
+        Call the function, or one of the tag_export functions by name, and
+        cache the result until the tags change.
+
+        Changes made through this PhotoDB clear the cache directly. Changes
+        committed by other connections or processes are detected through
+        SQLite's data_version, which is stored alongside each export.
+        '''
         if isinstance(function, str):
             function = getattr(tag_export, function)
-        if 'tags' in kwargs:
-            kwargs['tags'] = tuple(kwargs['tags'])
-        key = (function.__name__,) + helpers.dict_to_tuple(kwargs)
+        if not kwargs:
+            # The common case for get_all_tag_names and get_all_synonyms.
+            # We key by name rather than by the function itself so that the
+            # cache does not hold a reference to this PhotoDB via bound methods.
+            key = function.__name__
+        else:
+            key_kwargs = kwargs
+            if 'tags' in kwargs:
+                kwargs['tags'] = tuple(kwargs['tags'])
+                # Tag objects hash by formatting a string and compare through
+                # Python-level __eq__, while their id strings cache their hash
+                # and compare in C, so the key uses the ids.
+                key_kwargs = dict(kwargs, tags=tuple(tag.id for tag in kwargs['tags']))
+            key = (function.__name__,) + helpers.dict_to_tuple(key_kwargs)
+        data_version = self.get_data_version()
         try:
-            exp = self.caches['tag_exports'][key]
-            return exp
+            (version, exp) = self.caches['tag_exports'][key]
         except KeyError:
-            exp = function(**kwargs)
-            if isinstance(exp, types.GeneratorType):
-                exp = tuple(exp)
-            self.caches['tag_exports'][key] = exp
-            return exp
+            pass
+        else:
+            if version == data_version:
+                return exp
+
+        exp = function(**kwargs)
+        if isinstance(exp, types.GeneratorType):
+            exp = tuple(exp)
+        self.caches['tag_exports'][key] = (data_version, exp)
+        return exp
 
     def get_root_tags(self) -> typing.Iterable[objects.Tag]:
         '''
@@ -501,22 +854,33 @@ class PDBTagMixin:
         except (exceptions.TagTooShort, exceptions.TagTooLong):
             raise exceptions.NoSuchTag(tagname)
 
-        while True:
-            # Return if it's a toplevel...
-            tag_row = self.select_one('SELECT * FROM tags WHERE name == ?', [tagname])
-            if tag_row is not None:
-                break
+        # Another connection or process may have renamed the tag or moved the
+        # synonym since the name was cached, so each entry remembers the
+        # data_version it was read at, like the tag exports do.
+        data_version = self.get_data_version()
+        try:
+            (version, tag_id) = self.caches['tag_by_name'][tagname]
+        except KeyError:
+            pass
+        else:
+            if version == data_version:
+                try:
+                    return self.get_tag_by_id(tag_id)
+                except exceptions.NoSuchTag:
+                    pass
+            self.caches['tag_by_name'].remove(tagname)
 
-            # ...or resolve the synonym and try again.
-            query = 'SELECT mastername FROM tag_synonyms WHERE name == ?'
-            bindings = [tagname]
-            mastername = self.select_one_value(query, bindings)
-            if mastername is None:
-                # was not a master tag or synonym
-                raise exceptions.NoSuchTag(tagname)
-            tagname = mastername
+        tag_row = self.select_one(SQL_TAG_BY_NAME, [tagname])
+        if tag_row is None:
+            # was not a master tag or synonym
+            raise exceptions.NoSuchTag(tagname)
 
         tag = self.get_cached_instance(objects.Tag, tag_row)
+        # Inside our own transaction the row may be uncommitted, and a
+        # rollback would leave the name cached for a tag or synonym that does
+        # not exist, so only committed names are cached.
+        if self._worms_transaction_owner != threading.current_thread().ident:
+            self.caches['tag_by_name'][tagname] = (data_version, tag.id)
         return tag
 
     def get_tag_count(self) -> int:
@@ -531,6 +895,62 @@ class PDBTagMixin:
     def get_tags_by_id(self, ids) -> typing.Iterable[objects.Tag]:
         return self.get_objects_by_id(objects.Tag, ids)
 
+    def get_tags_by_names(self, names) -> dict:
+        '''
+        Return a dictionary of {normalized name: Tag} for each of the given
+        names which is an existing tag or synonym. Names which do not exist,
+        or which fail normalization, are omitted.
+
+        This is better than calling get_tag_by_name in a loop because we can
+        resolve all of the names and synonyms in a single query.
+        '''
+        normalized = set()
+        for name in names:
+            try:
+                normalized.add(self.normalize_tagname(name))
+            except (exceptions.TagTooShort, exceptions.TagTooLong):
+                pass
+
+        query = '''
+        SELECT tags.name AS lookup, tags.* FROM tags WHERE tags.name IN ({qmarks})
+        UNION ALL
+        SELECT tag_synonyms.name AS lookup, tags.* FROM tag_synonyms
+        JOIN tags ON tags.name == tag_synonyms.mastername
+        WHERE tag_synonyms.name IN ({qmarks})
+        '''
+        tags = {}
+        for tag_row in self._select_in(query, normalized):
+            tags[tag_row['lookup']] = self.get_cached_instance(objects.Tag, tag_row)
+
+        return tags
+
+    def _get_tags_in_order(self, tags) -> list:
+        '''
+        Like [self.get_tag(name=tag) for tag in tags], but all of the names are
+        resolved with get_tags_by_names instead of one lookup each. Raises
+        exceptions.NoSuchTag for the first name that does not exist.
+        '''
+        tags = list(tags)
+        names = [
+            tag.name if isinstance(tag, objects.Tag) else tag
+            for tag in tags
+            if not (isinstance(tag, objects.Tag) and tag.photodb == self)
+        ]
+        found = self.get_tags_by_names(names) if names else {}
+
+        results = []
+        for tag in tags:
+            if isinstance(tag, objects.Tag):
+                if tag.photodb == self:
+                    results.append(tag)
+                    continue
+                tag = tag.name
+            try:
+                results.append(found[self.normalize_tagname(tag)])
+            except (KeyError, exceptions.TagTooShort, exceptions.TagTooLong):
+                raise exceptions.NoSuchTag(tag)
+        return results
+
     def get_tags_by_sql(self, query, bindings=None) -> typing.Iterable[objects.Tag]:
         return self.get_objects_by_sql(objects.Tag, query, bindings)
 
@@ -552,12 +972,13 @@ class PDBTagMixin:
         log.info('New Tag: %s %s.', tag_id, tagname)
 
         self.caches['tag_exports'].clear()
+        self.caches['tag_by_name'].clear()
 
         data = {
             'id': tag_id,
             'name': tagname,
             'description': description,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
             'author_id': author_id,
         }
         self.insert(table=objects.Tag, pairs=data)
@@ -570,8 +991,8 @@ class PDBTagMixin:
         tagname = objects.Tag.normalize_name(
             tagname,
             # valid_chars=self.config['tag']['valid_chars'],
-            min_length=self.config['tag']['min_length'],
-            max_length=self.config['tag']['max_length'],
+            min_length=self._min_tagname_length,
+            max_length=self._max_tagname_length,
         )
         return tagname
 
@@ -593,27 +1014,27 @@ class PDBUserMixin:
         if not isinstance(password, bytes):
             raise TypeError(f'Password must be {bytes}, not {type(password)}.')
 
-        if len(password) < self.config['user']['min_password_length']:
-            raise exceptions.PasswordTooShort(min_length=self.config['user']['min_password_length'])
+        if len(password) < self._min_password_length:
+            raise exceptions.PasswordTooShort(min_length=self._min_password_length)
 
     def assert_valid_username(self, username) -> None:
         if not isinstance(username, str):
             raise TypeError(f'Username must be {str}, not {type(username)}.')
 
-        if len(username) < self.config['user']['min_username_length']:
+        if len(username) < self._min_username_length:
             raise exceptions.UsernameTooShort(
                 username=username,
-                min_length=self.config['user']['min_username_length']
+                min_length=self._min_username_length,
             )
 
-        if len(username) > self.config['user']['max_username_length']:
+        if len(username) > self._max_username_length:
             raise exceptions.UsernameTooLong(
                 username=username,
-                max_length=self.config['user']['max_username_length']
+                max_length=self._max_username_length,
             )
 
-        badchars = [c for c in username if c not in self.config['user']['valid_chars']]
-        if badchars:
+        if not self._valid_username_chars.issuperset(username):
+            badchars = [c for c in username if c not in self._valid_username_chars]
             raise exceptions.InvalidUsernameChars(username=username, badchars=badchars)
 
     def get_user(self, username=None, id=None) -> objects.User:
@@ -632,7 +1053,7 @@ class PDBUserMixin:
         return self.get_object_by_id(objects.User, id)
 
     def get_user_by_username(self, username) -> objects.User:
-        user_row = self.select_one('SELECT * FROM users WHERE username == ?', [username])
+        user_row = self.select_one(SQL_USER_BY_USERNAME, [username])
 
         if user_row is None:
             raise exceptions.NoSuchUser(username)
@@ -664,6 +1085,8 @@ class PDBUserMixin:
 
         elif isinstance(user_obj_or_id, str):
             # Confirm that this string is a valid ID and not junk.
+            # Repeated ids are served from the User cache by get_object_by_id,
+            # so ingest loops with the same author do not select every time.
             author_id = self.get_user(id=user_obj_or_id).id
 
         else:
@@ -680,17 +1103,43 @@ class PDBUserMixin:
     def get_users_by_sql(self, query, bindings=None) -> typing.Iterable[objects.User]:
         return self.get_objects_by_sql(objects.User, query, bindings)
 
+    def hash_password(self, password) -> bytes:
+        '''
+        Validate the password and return its bcrypt hash.
+
+        Hashing is deliberately slow, so callers should do it before opening
+        a transaction and pass the result to new_user as hashed_password,
+        rather than holding the write lock for the duration of the hash.
+        '''
+        if not isinstance(password, bytes):
+            password = password.encode('utf-8')
+
+        self.assert_valid_password(password)
+        return bcrypt.hashpw(password, bcrypt.gensalt(rounds=self.config['user']['bcrypt_rounds']))
+
     @decorators.required_feature('user.new')
     @worms.atomic
-    def new_user(self, username, password, *, display_name=None) -> objects.User:
+    def new_user(
+            self,
+            username,
+            password=None,
+            *,
+            display_name=None,
+            hashed_password=None,
+        ) -> objects.User:
+        '''
+        Provide either the plain password, or the hashed_password which was
+        returned by hash_password.
+        '''
+        if (password is None) == (hashed_password is None):
+            raise exceptions.NotExclusive(['password', 'hashed_password'])
+
         # These might raise exceptions.
         self.assert_valid_username(username)
         self.assert_no_such_user(username=username)
 
-        if not isinstance(password, bytes):
-            password = password.encode('utf-8')
-
-        self.assert_valid_password(password)
+        if hashed_password is None:
+            hashed_password = self.hash_password(password)
 
         display_name = objects.User.normalize_display_name(
             display_name,
@@ -701,14 +1150,12 @@ class PDBUserMixin:
         user_id = self.generate_id(objects.User)
         log.info('New User: %s %s.', user_id, username)
 
-        hashed_password = bcrypt.hashpw(password, bcrypt.gensalt())
-
         data = {
             'id': user_id,
             'username': username,
             'password': hashed_password,
             'display_name': display_name,
-            'created': timetools.now().timestamp(),
+            'created': time.time(),
         }
         self.insert(table=objects.User, pairs=data)
 
@@ -720,7 +1167,6 @@ class PDBUtilMixin:
     def __init__(self):
         super().__init__()
 
-    @worms.atomic
     def digest_directory(
             self,
             directory,
@@ -776,7 +1222,7 @@ class PDBUtilMixin:
             same order that the files are listed when natural sorted. This is
             essentially an aesthetic preference, that when you are viewing the
             photos sorted by timestamp they are also natural sorted.
-            See stringtools.natural_sorter.
+            See helpers.natural_sort_key.
 
         new_photo_kwargs:
             A dict of kwargs to pass into every call of new_photo.
@@ -802,6 +1248,19 @@ class PDBUtilMixin:
 
         yield_photos:
             If True, yield Photos as they are processed, new or not.
+
+        Results are yielded one directory at a time, after that directory has
+        been written. While it is written, the files of the next directory,
+        if the walk has already found it, are being hashed in the background.
+        If you stop iterating early, the pending hashes are cancelled and
+        directories which were not yet yielded are not written.
+
+        Transactions:
+            If you call this inside of a transaction, all of the digest's work
+            happens in that transaction and is committed once, when you commit.
+            Otherwise, each directory is committed in its own transaction, so
+            there is one commit per directory rather than one per photo, and
+            other writers are not locked out for the entire digest.
         '''
         def _normalize_directory(directory):
             directory = pathclass.Path(directory)
@@ -840,40 +1299,162 @@ class PDBUtilMixin:
                 return new_photo_ratelimit
             raise TypeError(new_photo_ratelimit)
 
+        rename_index = None
+        rename_sizes = None
+        # {bytesize: bool} whether any photo of that size is missing its file.
+        orphan_sizes = {}
+        def build_rename_index():
+            '''
+            Rather than querying the database for mtime+bytes matches for every
+            new file, select them all once and serve check_renamed from memory.
+            The index is only built when the first new file is encountered.
+            '''
+            nonlocal rename_index
+            nonlocal rename_sizes
+            rename_index = {}
+            rename_sizes = {}
+            query = 'SELECT id, mtime, bytes FROM photos'
+            for (photo_id, mtime, bytes) in self.select(query):
+                rename_sizes.setdefault(bytes, []).append(photo_id)
+                if mtime:
+                    rename_index.setdefault((mtime, bytes), []).append(photo_id)
+
+        def could_be_renamed(stat):
+            '''
+            A file can only be a rename of an existing photo, by hash or by
+            mtime+bytesize, if some photo with the same bytesize is missing its
+            file. Checking that costs a few stats per distinct size, which is
+            much cheaper than hashing a file that turns out to be new.
+            '''
+            if rename_sizes is None:
+                build_rename_index()
+            size = stat.st_size
+            if size not in rename_sizes:
+                return False
+            if size not in orphan_sizes:
+                candidates = select_filepaths(rename_sizes[size])
+                orphan_sizes[size] = any(not os.path.isfile(filepath) for (photo_id, filepath) in candidates)
+            return orphan_sizes[size]
+
+        def select_filepaths(photo_ids):
+            '''
+            Return a list of (id, filepath) for the given photo ids. The rename
+            candidates are checked against the disk by filepath alone, so that
+            the ones which still have their files are never built into Photo
+            objects and don't crowd the photo cache.
+            '''
+            query = 'SELECT id, filepath FROM photos WHERE id IN ({qmarks})'
+            return list(self._select_in(query, photo_ids))
+
+        def check_renamed_by_meta(filepath, stat):
+            '''
+            Return the Photo if there is exactly one Photo with the same mtime
+            and bytesize as this file whose own file is missing, else None.
+            '''
+            if rename_index is None:
+                build_rename_index()
+            same_meta = rename_index.get((stat.st_mtime, stat.st_size), [])
+
+            if not same_meta:
+                return None
+
+            # We only care whether there is exactly one candidate whose file
+            # is missing, so stop checking the disk as soon as we see two.
+            orphans = []
+            for (photo_id, filepath) in select_filepaths(same_meta):
+                if os.path.isfile(filepath):
+                    continue
+                orphans.append(photo_id)
+                if len(orphans) > 1:
+                    break
+            if len(orphans) == 1:
+                return self.get_photo(orphans[0])
+            return None
+
+        def hash_file(filepath, progressbar=None):
+            return helpers.hash_file(filepath, progressbar=progressbar, **hash_kwargs)
+
+        def prehash_new_files(files, existing_photos):
+            '''
+            Submit the files which are not yet in the database and will not be
+            resolved by an mtime+bytesize match to the hash pool, since hashlib
+            releases the GIL while hashing. The futures are stored in
+            hash_futures for check_renamed to use, and they keep running while
+            the consumer is busy writing the previous directory.
+            '''
+            new_files = [file for file in files if file.absolute_path.lower() not in existing_photos]
+            # Each stat is a syscall which may be slow on network drives, so
+            # the new files are stat'ed in parallel and check_renamed reuses
+            # the results instead of stat'ing again.
+            stats = helpers.threaded_map(lambda file: file.stat, new_files)
+            file_stats.update(zip(new_files, stats))
+
+            # If new_photo is going to load metadata, it will need the hash
+            # anyway, so we might as well compute it here in parallel.
+            do_metadata = new_photo_kwargs.get('do_metadata', True)
+            needs_hash = [
+                file for file in new_files
+                if (do_metadata or could_be_renamed(file_stats[file]))
+                and check_renamed_by_meta(file, file_stats[file]) is None
+            ]
+            for file in needs_hash:
+                hash_futures[file] = hash_pool.submit(hash_file, file)
+
+        def preload_photos_by_hash(files):
+            '''
+            Select the hash matches for every prehashed file in the directory
+            which could be a rename, all at once, so that check_renamed does
+            not need one select per file.
+            '''
+            sha256s = set()
+            for file in files:
+                future = hash_futures.get(file, None)
+                stat = file_stats.get(file, None)
+                if future is None or stat is None or not could_be_renamed(stat):
+                    continue
+                sha256s.add(future.result())
+
+            photos_by_hash.clear()
+            photos_by_hash.update({sha256: [] for sha256 in sha256s})
+            for photo in self.get_photos_by_hashes(sha256s):
+                photos_by_hash[photo.sha256].append(photo)
+
         def check_renamed(filepath):
             '''
             We'll do our best to determine if this file is actually a rename of
             a file that's already in the database.
             '''
-            same_meta = self.get_photos_by_sql(
-                'SELECT * FROM photos WHERE mtime != 0 AND mtime == ? AND bytes == ?',
-                [filepath.stat.st_mtime, filepath.stat.st_size]
-            )
-            same_meta = [photo for photo in same_meta if not photo.real_path.is_file]
-            if len(same_meta) == 1:
-                photo = same_meta[0]
+            stat = file_stats.pop(filepath, None) or filepath.stat
+            photo = check_renamed_by_meta(filepath, stat)
+            if photo is not None:
                 log.debug('Found mtime+bytesize match %s.', photo)
                 return photo
 
-            log.loud('Hashing file %s to check for rename.', filepath)
-
-            if filepath.size > 100 * (2 ** 20):
-                progressbar = progressbars.bar1_bytestring()
-            else:
-                progressbar = None
-
-            sha256 = spinal.hash_file(
-                filepath,
-                hash_class=hashlib.sha256, **hash_kwargs,
-                progressbar=progressbar,
-            ).hexdigest()
-
-            same_hash = self.get_photos_by_hash(sha256)
+            future = hash_futures.pop(filepath, None)
+            sha256 = None if future is None else future.result()
+            if not could_be_renamed(stat):
+                # No need to hash the file or look for hash matches. If we
+                # prehashed it then new_photo can still use that.
+                if sha256 is None:
+                    return None
+                return {'sha256': sha256}
+
+            if sha256 is None:
+                log.loud('Hashing file %s to check for rename.', filepath)
+                if stat.st_size > 100 * (2 ** 20):
+                    progressbar = progressbars.bar1_bytestring()
+                else:
+                    progressbar = None
+                sha256 = hash_file(filepath, progressbar=progressbar)
+
+            same_hash = photos_by_hash.get(sha256, None)
+            if same_hash is None:
+                same_hash = self.get_photos_by_hash(sha256)
             same_hash = [photo for photo in same_hash if not photo.real_path.is_file]
 
             # fwiw, I'm not checking byte size since it's a hash match.
             if len(same_hash) > 1:
-                same_hash = [photo for photo in same_hash if photo.mtime == filepath.stat.st_mtime]
+                same_hash = [photo for photo in same_hash if photo.mtime == stat.st_mtime]
             if len(same_hash) == 1:
                 return same_hash[0]
 
@@ -881,24 +1462,39 @@ class PDBUtilMixin:
             # hash work by passing this as the known_hash to new_photo.
             return {'sha256': sha256}
 
-        def create_or_fetch_photo(filepath):
+        def fetch_photo(filepath, existing_photos):
             '''
-            Given a filepath, find the corresponding Photo object if it exists,
-            otherwise create it and then return it.
+            Given a filepath, find the corresponding Photo object if it exists
+            or if the file is a rename of an existing Photo.
+
+            existing_photos:
+                A dictionary of {lowercase filepath: Photo} which has been
+                bulk-fetched for the current directory.
+
+            Returns a tuple of (Photo or None, sha256 or None). If the Photo is
+            None, the file is new and sha256 is its hash, if it was computed.
             '''
-            try:
-                return (self.get_photo_by_path(filepath), False)
-            except exceptions.NoSuchPhoto:
-                pass
+            photo = existing_photos.get(filepath.absolute_path.lower(), None)
+            if photo is not None:
+                return (photo, None)
 
             result = check_renamed(filepath)
             if isinstance(result, objects.Photo):
                 result.relocate(filepath.absolute_path)
-                return (result, False)
+                return (result, None)
             elif isinstance(result, dict) and 'sha256' in result:
-                sha256 = result['sha256']
+                return (None, result['sha256'])
             else:
-                sha256 = None
+                return (None, None)
+
+        def create_or_fetch_photo(filepath, existing_photos):
+            '''
+            Given a filepath, find the corresponding Photo object if it exists,
+            otherwise create it and then return it.
+            '''
+            (photo, sha256) = fetch_photo(filepath, existing_photos)
+            if photo is not None:
+                return (photo, False)
 
             photo = self.new_photo(filepath, known_hash=sha256, **new_photo_kwargs)
             if new_photo_ratelimit is not None:
@@ -906,22 +1502,74 @@ class PDBUtilMixin:
 
             return (photo, True)
 
-        def create_or_fetch_current_albums(albums_by_path, current_directory):
-            current_albums = albums_by_path.get(current_directory.absolute_path, None)
+        def create_or_fetch_photos(files, existing_photos):
+            '''
+            Like create_or_fetch_photo for a whole directory, except the new
+            Photos are created with new_photos so their rows are inserted with
+            a single executemany per chunk instead of one insert per file.
+            The new Photos are still created in the same order as files.
+            '''
+            if new_photo_ratelimit is not None:
+                return [create_or_fetch_photo(file, existing_photos) for file in files]
+
+            results = [fetch_photo(file, existing_photos) for file in files]
+            new_files = [file for (file, (photo, sha256)) in zip(files, results) if photo is None]
+            sha256s = {file: sha256 for (file, (photo, sha256)) in zip(files, results) if sha256 is not None}
+
+            created = []
+            chunk_size = 128
+            for index in range(0, len(new_files), chunk_size):
+                chunk = new_files[index:index + chunk_size]
+                known = {file: sha256s[file] for file in chunk if file in sha256s}
+                created.extend(self.new_photos(chunk, known_hashes=known, **new_photo_kwargs))
+
+            created = iter(created)
+            photos = []
+            for (photo, sha256) in results:
+                if photo is None:
+                    photos.append((next(created), True))
+                else:
+                    photos.append((photo, False))
+            return photos
+
+        def create_or_fetch_current_albums(albums_by_path, existing_albums, current_directory, directory_path):
+            current_albums = albums_by_path.get(directory_path, None)
             if current_albums is not None:
                 return current_albums
 
-            current_albums = list(self.get_albums_by_path(current_directory.absolute_path))
+            current_albums = existing_albums.get(directory_path.lower(), [])
             if not current_albums:
                 current_albums = [self.new_album(
-                    associated_directories=current_directory.absolute_path,
+                    associated_directories=directory_path,
                     title=current_directory.basename,
                 )]
 
-            albums_by_path[current_directory.absolute_path] = current_albums
+            albums_by_path[directory_path] = current_albums
             return current_albums
 
-        def orphan_join_parent_albums(albums_by_path, current_albums, current_directory):
+        def preload_existing_albums(directory):
+            '''
+            Return a dictionary of {lowercase directory: [Albums]} for every
+            associated directory at or beneath the digest root, using one
+            select instead of one per directory visited by the walk.
+            '''
+            query = '''
+            SELECT directory, albumid FROM album_associated_directories
+            WHERE directory == ? OR (directory >= ? AND directory < ?)
+            '''
+            bindings = [directory.absolute_path, *helpers.directory_range(directory)]
+            album_ids_by_path = {}
+            for (associated, album_id) in self.select(query, bindings):
+                album_ids_by_path.setdefault(associated.lower(), []).append(album_id)
+
+            all_ids = {album_id for album_ids in album_ids_by_path.values() for album_id in album_ids}
+            albums = {album.id: album for album in self.get_albums_by_id(all_ids)}
+            return {
+                associated: [albums[album_id] for album_id in album_ids if album_id in albums]
+                for (associated, album_ids) in album_ids_by_path.items()
+            }
+
+        def orphan_join_parent_albums(albums_by_path, current_albums, parent_path):
             '''
             If the current album is an orphan, let's check if there exists an
             album for the parent directory. If so, add the current album to it.
@@ -930,7 +1578,7 @@ class PDBUtilMixin:
             if not orphans:
                 return
 
-            parents = albums_by_path.get(current_directory.parent.absolute_path, None)
+            parents = albums_by_path.get(parent_path, None)
             if not parents:
                 return
 
@@ -940,28 +1588,74 @@ class PDBUtilMixin:
         directory = _normalize_directory(directory)
         exclude_directories = _normalize_exclude_directories(exclude_directories)
         exclude_filenames = _normalize_exclude_filenames(exclude_filenames)
-        hash_kwargs = hash_kwargs or {}
+        hash_kwargs = dict(hash_kwargs or {})
+        # Share one ratelimiter between all of the hashing threads so that
+        # bytes_per_second stays a global limit.
+        if 'bytes_per_second' in hash_kwargs:
+            hash_kwargs['bytes_per_second'] = spinal.limiter_or_none(hash_kwargs['bytes_per_second'])
+        hash_kwargs.setdefault('chunk_size', self.config['hash_chunk_size'])
         new_photo_kwargs = _normalize_new_photo_kwargs(new_photo_kwargs)
         new_photo_ratelimit = _normalize_new_photo_ratelimit(new_photo_ratelimit)
 
         albums_by_path = {}
+        # {filepath: Future of sha256} for new files being hashed in advance.
+        hash_futures = {}
+        # {filepath: os.stat_result} for new files, from prehash_new_files.
+        file_stats = {}
+        # {sha256: [Photos]} for the current directory's rename candidates.
+        photos_by_hash = {}
+        # Albums which already existed in the database for any directory in
+        # the tree, so that only true misses fall through to new_album.
+        if make_albums:
+            existing_albums = preload_existing_albums(directory)
+        else:
+            existing_albums = {}
 
-        log.info('Digesting directory "%s".', directory.absolute_path)
-        walk_generator = spinal.walk(
-            directory,
-            exclude_directories=exclude_directories,
-            exclude_filenames=exclude_filenames,
-            glob_directories=glob_directories,
-            glob_filenames=glob_filenames,
-            recurse=recurse,
-            yield_style='nested',
-        )
-
-        for (current_directory, subdirectories, files) in walk_generator:
-            if natural_sort:
-                files = sorted(files, key=lambda f: stringtools.natural_sorter(f.basename))
+        def walk_producer(walk_queue, stop_event):
+            '''
+            Walk the directory tree on a separate thread so the filesystem
+            traversal overlaps with the database work of the consumer. Each
+            item is a (directory, subdirectories, files) tuple, followed by
+            None when the walk is finished. If the walk raises, the exception
+            is put on the queue for the consumer to re-raise.
+            '''
+            def put(item):
+                while not stop_event.is_set():
+                    try:
+                        walk_queue.put(item, timeout=1)
+                        return True
+                    except queue.Full:
+                        pass
+                return False
+
+            walk_generator = spinal.walk(
+                directory,
+                exclude_directories=exclude_directories,
+                exclude_filenames=exclude_filenames,
+                glob_directories=glob_directories,
+                glob_filenames=glob_filenames,
+                recurse=recurse,
+                yield_style='nested',
+            )
+            try:
+                for (current_directory, subdirectories, files) in walk_generator:
+                    if natural_sort:
+                        files = sorted(files, key=lambda f: helpers.natural_sort_key(f.basename))
+                    if not put((current_directory, subdirectories, files)):
+                        return
+            except Exception as exc:
+                put(exc)
+                return
+            put(None)
 
-            photos = [create_or_fetch_photo(file) for file in files]
+        def digest_one_directory(current_directory, subdirectories, files, existing_photos):
+            '''
+            Perform the database writes for one directory and return the list
+            of objects that should be yielded to the caller.
+            '''
+            results = []
+            preload_photos_by_hash(files)
+            photos = create_or_fetch_photos(files, existing_photos)
 
             # Note, this means that empty folders will not get an Album.
             # At this time this behavior is intentional. Furthermore, due to
@@ -969,23 +1663,96 @@ class PDBUtilMixin:
             # they don't contain any files of interest, even if they do contain
             # other files.
             if not photos:
-                continue
+                return results
 
             for (photo, is_new) in photos:
                 if (is_new and yield_new_photos) or (not is_new and yield_old_photos):
-                    yield photo
+                    results.append(photo)
 
             if not make_albums:
-                continue
+                return results
 
-            current_albums = create_or_fetch_current_albums(albums_by_path, current_directory)
-            orphan_join_parent_albums(albums_by_path, current_albums, current_directory)
+            # Path.parent builds a new Path each time, so we take both strings
+            # once for the album lookups.
+            directory_path = current_directory.absolute_path
+            parent_path = current_directory.parent.absolute_path
+            current_albums = create_or_fetch_current_albums(albums_by_path, existing_albums, current_directory, directory_path)
+            orphan_join_parent_albums(albums_by_path, current_albums, parent_path)
 
             for album in current_albums:
                 album.add_photos(photo for (photo, is_new) in photos)
 
             if yield_albums:
-                yield from current_albums
+                results.extend(current_albums)
+
+            return results
+
+        def prepare_directory(current_directory, subdirectories, files):
+            '''
+            Reading the existing photos and hashing the new files do not need
+            the write lock, so they happen before the transaction.
+            '''
+            existing_photos = {
+                photo.real_path.absolute_path.lower(): photo
+                for photo in self.get_photos_by_paths(files)
+            }
+            prehash_new_files(files, existing_photos)
+            return (current_directory, subdirectories, files, existing_photos)
+
+        def write_directory(current_directory, subdirectories, files, existing_photos):
+            # If the caller is already holding a transaction, for example
+            # so they can decide whether to commit the whole digest, we
+            # work inside of it. Otherwise each directory gets its own short
+            # transaction so other writers are not locked out for the
+            # entire digest.
+            if self._worms_transaction_owner == threading.current_thread().ident:
+                results = digest_one_directory(current_directory, subdirectories, files, existing_photos)
+            else:
+                with self.transaction:
+                    results = digest_one_directory(current_directory, subdirectories, files, existing_photos)
+
+            for file in files:
+                hash_futures.pop(file, None)
+                file_stats.pop(file, None)
+            return results
+
+        log.info('Digesting directory "%s".', directory.absolute_path)
+        walk_queue = queue.Queue(maxsize=16)
+        stop_event = threading.Event()
+        walk_thread = threading.Thread(target=walk_producer, args=(walk_queue, stop_event), daemon=True)
+        walk_thread.start()
+        max_workers = min(8, os.cpu_count() or 1)
+        hash_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+        try:
+            # We stay one directory ahead of the writes, so that the hash pool
+            # is working on the next directory's files while the current one
+            # is being written. But if the walk has not produced the next
+            # directory yet, we write the current one rather than holding
+            # its results back while we wait.
+            pending = None
+            while True:
+                try:
+                    item = walk_queue.get_nowait()
+                except queue.Empty:
+                    if pending is not None:
+                        yield from write_directory(*pending)
+                        pending = None
+                    item = walk_queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is not None:
+                    item = prepare_directory(*item)
+
+                if pending is not None:
+                    yield from write_directory(*pending)
+
+                if item is None:
+                    break
+                pending = item
+        finally:
+            stop_event.set()
+            hash_pool.shutdown(wait=False, cancel_futures=True)
 
     @worms.atomic
     def easybake(self, ebstring, author=None):
@@ -997,12 +1764,19 @@ class PDBUtilMixin:
         '''
         output_notes = []
 
-        def create_or_get(name):
+        def create_or_get(name, existing):
             try:
-                item = self.get_tag(name=name)
+                name = self.normalize_tagname(name)
+            except (exceptions.TagTooShort, exceptions.TagTooLong):
+                # Let new_tag raise the appropriate exception.
+                pass
+
+            item = existing.get(name, None)
+            if item is not None:
                 note = ('existing_tag', item.name)
-            except exceptions.NoSuchTag:
+            else:
                 item = self.new_tag(name, author=author)
+                existing[item.name] = item
                 note = ('new_tag', item.name)
             output_notes.append(note)
             return item
@@ -1017,7 +1791,8 @@ class PDBUtilMixin:
             output_notes.append(note)
         else:
             tag_parts = tagname.split('.')
-            tags = [create_or_get(t) for t in tag_parts]
+            existing = self.get_tags_by_names(tag_parts)
+            tags = [create_or_get(t, existing) for t in tag_parts]
             for (higher, lower) in zip(tags, tags[1:]):
                 try:
                     higher.add_child(lower)
@@ -1046,6 +1821,13 @@ class PhotoDB(
         PDBUtilMixin,
         worms.DatabaseWithCaching,
     ):
+    # Used by closest_photodb. Maps the absolute path of every directory that
+    # has been checked to its data directory path, or None if that directory
+    # does not contain one, so repeated lookups from nearby paths do not have
+    # to stat every ancestor again. Entries expire after a minute so that a
+    # data directory created by another process is eventually noticed.
+    _closest_cache = cacheclass.Cache(maxlen=1024, expiry=60)
+
     def __init__(
             self,
             data_directory=None,
@@ -1108,6 +1890,13 @@ class PhotoDB(
         self.thumbnail_directory = self.data_directory.with_child(constants.DEFAULT_THUMBDIR)
         self.thumbnail_directory.makedirs(exist_ok=True)
 
+        # IDS
+        # Random ids are drawn from os.urandom in bulk and handed out by
+        # generate_id, so we make one syscall per batch rather than per id.
+        # _id_bits is set by load_config.
+        self._id_pool = collections.deque()
+        self._id_bits = None
+
         # CONFIG
         self.config_filepath = self.data_directory.with_child(constants.DEFAULT_CONFIGNAME)
         self.load_config()
@@ -1138,12 +1927,15 @@ class PhotoDB(
 
     def _init_caches(self):
         self.caches = {
-            objects.Album: cacheclass.Cache(maxlen=self.config['cache_size']['album']),
-            objects.Bookmark: cacheclass.Cache(maxlen=self.config['cache_size']['bookmark']),
-            objects.Photo: cacheclass.Cache(maxlen=self.config['cache_size']['photo']),
-            objects.Tag: cacheclass.Cache(maxlen=self.config['cache_size']['tag']),
-            objects.User: cacheclass.Cache(maxlen=self.config['cache_size']['user']),
-            'tag_exports': cacheclass.Cache(maxlen=100),
+            objects.Album: helpers.LRUCache(maxlen=self.config['cache_size']['album']),
+            objects.Bookmark: helpers.LRUCache(maxlen=self.config['cache_size']['bookmark']),
+            objects.Photo: helpers.LRUCache(maxlen=self.config['cache_size']['photo']),
+            objects.Tag: helpers.LRUCache(maxlen=self.config['cache_size']['tag']),
+            objects.User: helpers.LRUCache(maxlen=self.config['cache_size']['user']),
+            'tag_exports': helpers.LRUCache(maxlen=100),
+            # Maps normalized tag names and synonyms to the id of their
+            # master tag. Cleared whenever tag names or synonyms change.
+            'tag_by_name': helpers.LRUCache(maxlen=1024),
         }
 
     def _init_column_index(self):
@@ -1151,6 +1943,11 @@ class PhotoDB(
         self.COLUMN_INDEX = constants.SQL_INDEX
 
     def _init_sql(self, create=False, skip_version_check=False):
+        self._read_pool = queue.Queue()
+        self._read_pool_connections = []
+        self._read_pool_lock = threading.Lock()
+        self._data_version_sql = None
+
         if self.ephemeral:
             existing_database = False
             self.sql_write = self._make_sqlite_write_connection(':memory:')
@@ -1166,7 +1963,21 @@ class PhotoDB(
             raise FileNotFoundError(msg)
 
         self.data_directory.makedirs(exist_ok=True)
+        self._closest_cache.remove(self.data_directory.parent.absolute_path)
         self.sql_write = self._make_sqlite_write_connection(self.database_filepath)
+        if not existing_database:
+            # Larger pages mean shallower btrees for our tables and indices.
+            # The page size is fixed once the database file has a header,
+            # which switching to WAL will write, so this must come first.
+            self.pragma_write('page_size', 8192)
+        # These cannot be changed inside a transaction, so they are set here
+        # rather than in _load_pragmas. WAL lets the read connections proceed
+        # while a write transaction is open. It is not supported by the
+        # in-memory database used for ephemeral mode. NORMAL is safe from
+        # corruption in WAL mode, though a power loss may roll back the most
+        # recent commits.
+        self.pragma_write('journal_mode', 'wal')
+        self.pragma_write('synchronous', 'NORMAL')
         self.sql_read = self._make_sqlite_read_connection(self.database_filepath)
 
         if existing_database:
@@ -1177,10 +1988,93 @@ class PhotoDB(
         else:
             self._first_time_setup()
 
+    @contextlib.contextmanager
+    def _acquire_read(self):
+        '''
+        Check out a read connection for the duration of the context.
+
+        The thread which owns the current transaction reads through sql_write
+        so that it sees its own uncommitted changes. Other threads get a
+        connection from the read pool, so that concurrent readers do not have
+        to share a single connection. The pool grows on demand up to
+        config['read_connections'].
+
+        When the pool is exhausted, the reader gets a temporary connection
+        which is closed afterwards, rather than waiting for one to be
+        returned. A select generator keeps its connection until it is
+        exhausted, so a thread which is iterating one select and issues
+        another would otherwise wait on itself, and a few threads doing
+        nested reads at once could wait on each other forever.
+        '''
+        if self._worms_transaction_owner == threading.current_thread().ident:
+            yield self.sql_write
+            return
+
+        temporary = False
+        try:
+            sql = self._read_pool.get_nowait()
+        except queue.Empty:
+            with self._read_pool_lock:
+                if len(self._read_pool_connections) < self.config['read_connections']:
+                    sql = self._make_pooled_read_connection()
+                    self._read_pool_connections.append(sql)
+                else:
+                    sql = None
+            if sql is None:
+                log.loud('Read pool is exhausted, opening a temporary connection.')
+                sql = self._make_pooled_read_connection()
+                temporary = True
+
+        try:
+            yield sql
+        finally:
+            if temporary:
+                sql.close()
+            else:
+                self._read_pool.put(sql)
+
+    def _make_pooled_read_connection(self):
+        if self.ephemeral:
+            path = f'file:{self._memdb_random}?mode=memory&cache=shared'
+        else:
+            path = f'file:{self.database_filepath.absolute_path}?mode=ro'
+        sql = sqlite3.connect(
+            path,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+        )
+        sql.row_factory = sqlite3.Row
+        return sql
+
+    def _make_sqlite_read_connection(self, path):
+        if isinstance(path, pathclass.Path):
+            path = path.absolute_path
+        if path == ':memory:':
+            path = f'file:{self._memdb_random}?mode=memory&cache=shared'
+        else:
+            log.debug('Connecting to sqlite file "%s".', path)
+            path = f'file:{path}?mode=ro'
+        sql_read = sqlite3.connect(path, uri=True, cached_statements=SQLITE_CACHED_STATEMENTS)
+        sql_read.row_factory = sqlite3.Row
+        return sql_read
+
+    def _make_sqlite_write_connection(self, path):
+        if isinstance(path, pathclass.Path):
+            path = path.absolute_path
+        if path == ':memory:':
+            path = f'file:{self._memdb_random}?mode=memory&cache=shared'
+            sql_write = sqlite3.connect(path, uri=True, cached_statements=SQLITE_CACHED_STATEMENTS)
+        else:
+            log.debug('Connecting to sqlite file "%s".', path)
+            sql_write = sqlite3.connect(path, cached_statements=SQLITE_CACHED_STATEMENTS)
+        sql_write.row_factory = sqlite3.Row
+        return sql_write
+
     def _load_pragmas(self):
         log.debug('Reloading pragmas.')
-        self.pragma_write('cache_size', 10000)
         self.pragma_write('foreign_keys', 'on')
+        self.pragma_write('temp_store', 'MEMORY')
 
     # Will add -> PhotoDB when forward references are supported
     @classmethod
@@ -1192,17 +2086,31 @@ class PhotoDB(
         '''
         path = pathclass.Path(path)
         starting = path
-
+        directory = starting.absolute_path
+
+        # The climb works on plain strings so we don't construct two Path
+        # objects for every ancestor. Only the result becomes a Path.
+        # We stat the one name we care about rather than scandir each
+        # ancestor, since listing a large directory costs far more than a
+        # single stat, and _closest_cache already remembers the answer for
+        # every directory we've checked.
+        datadir_name = constants.DEFAULT_DATADIR
         while True:
-            possible = path.with_child(constants.DEFAULT_DATADIR)
-            if possible.is_dir:
+            try:
+                possible = cls._closest_cache[directory]
+            except KeyError:
+                possible = os.path.join(directory, datadir_name)
+                if not os.path.isdir(possible):
+                    possible = None
+                cls._closest_cache[directory] = possible
+            if possible is not None:
                 break
-            parent = path.parent
-            if path == parent:
+            parent = os.path.dirname(directory)
+            if parent == directory:
                 raise exceptions.NoClosestPhotoDB(starting.absolute_path)
-            path = parent
+            directory = parent
 
-        path = possible
+        path = pathclass.Path(possible)
         log.debug('Found closest PhotoDB at "%s".', path.absolute_path)
 
         try:
@@ -1213,11 +2121,16 @@ class PhotoDB(
                 **kwargs,
             )
         except FileNotFoundError:
+            # The cached data directory may have been removed since.
+            cls._closest_cache.remove(directory)
             raise exceptions.NoClosestPhotoDB(starting.absolute_path)
 
         return photodb
 
-    def __del__(self):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
         self.close()
 
     def __repr__(self):
@@ -1230,37 +2143,231 @@ class PhotoDB(
         log.debug('Closing PhotoDB.')
         super().close()
 
+        for sql in getattr(self, '_read_pool_connections', []):
+            sql.close()
+        self._read_pool_connections = []
+        self._read_pool = queue.Queue()
+
+        if getattr(self, '_data_version_sql', None) is not None:
+            self._data_version_sql.close()
+            self._data_version_sql = None
+
         if getattr(self, 'ephemeral', False):
             self.ephemeral_directory.cleanup()
+        elif hasattr(self, 'data_directory'):
+            self._closest_cache.remove(self.data_directory.parent.absolute_path)
+
+    def get_data_version(self) -> int:
+        '''
+        Return SQLite's data_version as seen by a dedicated read connection.
+        This number changes whenever any other connection, including this
+        PhotoDB's write connection, commits a change to the database.
+        Uncommitted changes in the current transaction are not reflected.
+        '''
+        with self._read_pool_lock:
+            if self._data_version_sql is None:
+                self._data_version_sql = self._make_pooled_read_connection()
+            return self._data_version_sql.execute('PRAGMA data_version').fetchone()[0]
+
+    def executemany(self, query, bindings_list) -> sqlite3.Cursor:
+        '''
+        Execute the query once for each set of bindings in a single call,
+        which is much faster than calling execute in a loop.
+        '''
+        self.assert_transaction_active()
+        bindings_list = list(bindings_list)
+        cur = self.sql_write.cursor()
+        log.loud('%s x%d', query, len(bindings_list))
+        cur.executemany(query, bindings_list)
+        return cur
 
     def generate_id(self, thing_class) -> int:
         '''
-        Create a new ID number that is unique to the given table.
+        Create a new random ID number for the given table.
+
+        The ID is not checked against the table ahead of time because with
+        random ids of this size a collision is extremely unlikely, so that
+        query would almost always be wasted. Instead, insert catches the
+        primary key violation and draws a new ID in the rare case of a
+        collision.
         '''
-        if not issubclass(thing_class, objects.ObjectBase):
+        if not getattr(thing_class, '_is_object_base', False):
             raise TypeError(thing_class)
 
-        table = thing_class.table
+        try:
+            return self._id_pool.popleft()
+        except IndexError:
+            self._refill_id_pool(self._id_bits)
+            return self._id_pool.popleft()
+
+    def _refill_id_pool(self, length, count=256) -> None:
+        '''
+        Fill the id pool with `count` random ids of `length` bits each, using
+        a single os.urandom call.
+        '''
+        id_bytes = (length + 7) // 8
+        mask = (1 << length) - 1
+        data = os.urandom(count * id_bytes)
+        self._id_pool.extend(
+            int.from_bytes(data[index:index + id_bytes], 'big') & mask
+            for index in range(0, len(data), id_bytes)
+        )
+
+    @staticmethod
+    def _is_id_collision(exc, table) -> bool:
+        return str(exc) == f'UNIQUE constraint failed: {table}.id'
+
+    def insert(self, table, pairs) -> sqlite3.Cursor:
+        '''
+        If the table is one of our object classes and the new row's id is
+        already taken, draw a new id with generate_id and try again. The pairs
+        dictionary is updated in place so the caller sees the final id.
+        '''
+        is_object = getattr(table, '_is_object_base', False)
+        if not is_object or 'id' not in pairs:
+            return super().insert(table=table, pairs=pairs)
 
-        length = self.config['id_bits']
         for retry in range(10):
-            id = RNG.getrandbits(length)
-            if not self.exists(f'SELECT 1 FROM {table} WHERE id == ?', [id]):
-                return id
-        raise exceptions.GenerateIDFailed(table=table)
+            try:
+                return super().insert(table=table, pairs=pairs)
+            except sqlite3.IntegrityError as exc:
+                if not self._is_id_collision(exc, table.table):
+                    raise
+                log.debug('ID %s collided in %s, trying another.', pairs['id'], table.table)
+                pairs['id'] = self.generate_id(table)
+        raise exceptions.GenerateIDFailed(table=table.table)
+
+    def select(self, query, bindings=None) -> typing.Iterable:
+        if bindings is None:
+            bindings = []
+        with self._acquire_read() as sql:
+            cur = sql.cursor()
+            log.loud('%s %s', query, bindings)
+            cur.execute(query, bindings)
+            # Fetching in batches takes far fewer trips into the sqlite3
+            # module than fetchone for large result sets.
+            while True:
+                rows = cur.fetchmany(1024)
+                if not rows:
+                    break
+                yield from rows
+
+    def _select_in(self, query, values, batch_size=999) -> typing.Iterable:
+        '''
+        Yield the rows of the query for all of the values, where the query
+        contains `IN ({qmarks})`. SQLite3 has a limit of 999 ? in a query, so
+        the values are bound in batches. If {qmarks} appears more than once,
+        each batch is bound once for each of them.
+        '''
+        values = list(values)
+        repeats = query.count('{qmarks}')
+        batch_size //= repeats
+        for index in range(0, len(values), batch_size):
+            batch = values[index:index + batch_size]
+            qmarks = ','.join('?' * len(batch))
+            yield from self.select(query.replace('{qmarks}', qmarks), batch * repeats)
+
+    def select_one(self, query, bindings=None):
+        if bindings is None:
+            bindings = []
+        with self._acquire_read() as sql:
+            cur = sql.cursor()
+            log.loud('%s %s', query, bindings)
+            cur.execute(query, bindings)
+            return cur.fetchone()
+
+    def select_one_value(self, query, bindings=None, fallback=None):
+        row = self.select_one(query, bindings)
+        if row:
+            return row[0]
+        else:
+            return fallback
 
     def load_config(self) -> None:
         log.debug('Loading config file.')
-        (config, needs_rewrite) = configlayers.load_file(
-            filepath=self.config_filepath,
-            default_config=constants.DEFAULT_CONFIGURATION,
-        )
+        # This does the same as configlayers.load_file, except that we read
+        # the bytes ourselves so they can be parsed and hashed for save_config
+        # without reading the file twice.
+        try:
+            content = self.config_filepath.read('rb')
+        except FileNotFoundError:
+            content = None
+
+        config = copy.deepcopy(constants.DEFAULT_CONFIGURATION)
+        if content is None:
+            needs_rewrite = True
+        else:
+            if not content.strip():
+                user_config = {}
+            else:
+                user_config = json.loads(content)
+            (config, needs_rewrite) = configlayers.layer_json(target=config, supply=user_config)
         self.config = config
+        # The user and tag validation methods read these flat attributes rather
+        # than digging through the nested config on every call.
+        self._min_tagname_length = self.config['tag']['min_length']
+        self._max_tagname_length = self.config['tag']['max_length']
+        self._min_password_length = self.config['user']['min_password_length']
+        self._min_username_length = self.config['user']['min_username_length']
+        self._max_username_length = self.config['user']['max_username_length']
+        self._valid_username_chars = frozenset(self.config['user']['valid_chars'])
+
+        # The memory pragmas come from the config, so they are applied here
+        # rather than in _load_pragmas, which runs before the config is loaded.
+        # Negative cache_size is measured in KiB rather than pages.
+        self.pragma_write('cache_size', -int(self.config['sqlite']['cache_size_kib']))
+        self.pragma_write('mmap_size', int(self.config['sqlite']['mmap_size']))
+
+        # Ids already in the pool were drawn with the old id_bits.
+        if self.config['id_bits'] != self._id_bits:
+            self._id_pool.clear()
+        self._id_bits = self.config['id_bits']
+
+        # needs_rewrite is set when the file was missing any keys, but the
+        # rewrite often comes out identical to what's already on disk. By
+        # remembering the hash of the file's current bytes, save_config will
+        # skip the write in that case.
+        if content is None:
+            self._last_config_hash = None
+        else:
+            self._last_config_hash = self._config_hash(content)
 
         if needs_rewrite:
             self.save_config()
 
+    def _serialize_config(self) -> bytes:
+        '''
+        The config is written in the same format it always has been, so that
+        existing config files compare as unchanged. We use json for reading
+        and writing rather than orjson, which formats some floats differently,
+        can't write integers wider than 64 bits, and reads them back as floats.
+        '''
+        return json.dumps(self.config, indent=4, sort_keys=True).encode('utf-8')
+
+    @staticmethod
+    def _config_hash(payload) -> bytes:
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
     def save_config(self) -> None:
+        '''
+        Write the config to disk, unless it is unchanged since the last time
+        it was loaded or saved. The file is written to a temporary file first
+        and then moved into place, so a crash during the write can't leave
+        a truncated config behind.
+        '''
+        payload = self._serialize_config()
+        payload_hash = self._config_hash(payload)
+        if payload_hash == getattr(self, '_last_config_hash', None):
+            log.debug('Config file is unchanged, not saving.')
+            return
+
         log.debug('Saving config file.')
-        with self.config_filepath.open('w', encoding='utf-8') as handle:
-            handle.write(json.dumps(self.config, indent=4, sort_keys=True))
+        temp_filepath = self.config_filepath.add_extension('tmp')
+        with temp_filepath.open('wb') as handle:
+            handle.write(payload)
+            # Make sure the bytes are on disk before the rename, otherwise a
+            # crash could leave an empty file in place of the old config.
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_filepath.absolute_path, self.config_filepath.absolute_path)
+        self._last_config_hash = payload_hash
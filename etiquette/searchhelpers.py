@@ -3,6 +3,9 @@ This file provides helper functions used to normalize the arguments that
 go into search queries. Mainly converting the strings given by the user
 into proper data types.
 '''
+import string
+import types
+
 from . import constants
 from . import exceptions
 from . import helpers
@@ -388,7 +391,7 @@ def normalize_sha256(sha256, warning_bag=None):
     shas = set(sha256)
     goodshas = set()
     for sha in shas:
-        if isinstance(sha, str) and len(sha) == 64:
+        if isinstance(sha, str) and len(sha) == 64 and all(c in string.hexdigits for c in sha):
             goodshas.add(sha)
         else:
             exc = TypeError(f'sha256 should be the 64-character hexdigest string.')
@@ -577,3 +580,71 @@ def tag_expression_matcher_builder(frozen_children):
         return any(option in photo_tags for option in options)
 
     return match_function
+
+def filename_matcher_builder(filename_tree):
+    '''
+    Return a function `match(basename)` equivalent to
+    filename_tree.evaluate(basename).
+
+    Evaluating the tree walks every node with a method call and a generator
+    for each photo. Instead, we translate the tree into a single boolean
+    expression of `in` tests and compile it once per search. A very deeply
+    nested expression is more than the compiler will take, in which case we
+    fall back to evaluating the tree.
+    '''
+    def translate(node):
+        if node.token not in expressionmatch.OPERATORS:
+            return f'({node.token!r} in basename)'
+
+        children = [translate(child) for child in node.children]
+        if node.token == 'NOT':
+            if len(children) != 1:
+                raise ValueError('NOT only takes 1 value')
+            return f'(not {children[0]})'
+        if node.token == 'AND':
+            return '(' + (' and '.join(children) or 'True') + ')'
+        if node.token == 'OR':
+            return '(' + (' or '.join(children) or 'False') + ')'
+        # XOR is true when an odd number of the children are.
+        return '(sum((' + ''.join(f'{child}, ' for child in children) + ')) % 2 == 1)'
+
+    try:
+        return eval(f'lambda basename: {translate(filename_tree)}', {})
+    except (MemoryError, RecursionError, SyntaxError):
+        return filename_tree.evaluate
+
+# Maps (needs_filename, needs_tag_expression) to a compiled filter function.
+_photo_filter_cache = {}
+def photo_filter_builder(filename_tree, tag_expression_tree, tag_match_function):
+    '''
+    Return a function `filter(photo)` which returns True if the photo passes
+    the Python-side checks that could not be expressed in the SQL query.
+
+    Rather than testing at every row which of the checks are enabled for this
+    search, we generate a straight-line function containing only the checks
+    that are needed. The generated functions are cached by their shape, and
+    the specific trees for this search are bound as default arguments.
+    '''
+    key = (filename_tree is not None, tag_expression_tree is not None)
+    template = _photo_filter_cache.get(key, None)
+
+    if template is None:
+        lines = ['def _filter(photo, filename_match=None, tag_expression_tree=None, tag_match_function=None):']
+        if key[0]:
+            lines.append('    if not filename_match(photo.basename.lower()): return False')
+        if key[1]:
+            lines.append('    if not tag_expression_tree.evaluate(set(photo.get_tags()), match_function=tag_match_function): return False')
+        lines.append('    return True')
+        namespace = {}
+        exec('\n'.join(lines), namespace)
+        template = namespace['_filter']
+        _photo_filter_cache[key] = template
+
+    filename_match = None if filename_tree is None else filename_matcher_builder(filename_tree)
+
+    return types.FunctionType(
+        template.__code__,
+        template.__globals__,
+        template.__name__,
+        (filename_match, tag_expression_tree, tag_match_function),
+    )
@@ -95,13 +95,14 @@ def post_album_remove_thumbnail_photo(album_id):
 @site.route('/album/<album_id>/refresh_directories', methods=['POST'])
 def post_album_refresh_directories(album_id):
     common.permission_manager.basic()
-    with common.P.transaction:
-        album = common.P_album(album_id, response_type='json')
-        for directory in album.get_associated_directories():
-            if not directory.is_dir:
-                continue
-            digest = common.P.digest_directory(directory, new_photo_ratelimit=0.1)
-            gentools.run(digest)
+    album = common.P_album(album_id, response_type='json')
+    for directory in album.get_associated_directories():
+        if not directory.is_dir:
+            continue
+        # digest_directory opens a short transaction for each directory, so
+        # we don't hold the write lock for the whole refresh.
+        digest = common.P.digest_directory(directory, new_photo_ratelimit=0.1)
+        gentools.run(digest)
     return flasktools.json_response({})
 
 @site.route('/album/<album_id>/set_thumbnail_photo', methods=['POST'])
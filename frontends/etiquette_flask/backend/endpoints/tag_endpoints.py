@@ -115,7 +115,7 @@ def post_tag_remove_synonym(tagname):
 @flasktools.cached_endpoint(max_age=15)
 def get_all_tag_names():
     all_tags = list(sorted(common.P.get_all_tag_names()))
-    all_synonyms = common.P.get_all_synonyms()
+    all_synonyms = dict(common.P.get_all_synonyms())
     response = {'tags': all_tags, 'synonyms': all_synonyms}
     return flasktools.json_response(response)
 
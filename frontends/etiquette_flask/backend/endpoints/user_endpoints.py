@@ -135,8 +135,10 @@ def post_register():
         }
         return flasktools.json_response(response, status=422)
 
+    # Hash before taking the write lock, since bcrypt is slow on purpose.
+    hashed_password = common.P.hash_password(password_1)
     with common.P.transaction:
-        user = common.P.new_user(username, password_1, display_name=display_name)
+        user = common.P.new_user(username, hashed_password=hashed_password, display_name=display_name)
 
     request.session = sessions.Session(request, user)
     session_manager.add(request.session)
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import etiquette
+
+from voussoirkit import pathclass
+
+class TempDirTestCase(unittest.TestCase):
+    '''
+    Each test gets its own temporary directory as self.temp, which is also
+    used as XDG_CACHE_HOME so that nothing is left in the real cache.
+    '''
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.temp = pathclass.Path(tempdir.name)
+
+        environ = unittest.mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.temp.absolute_path})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def new_file(self, relative, content=None) -> str:
+        '''
+        Write the file beneath the temporary directory, creating its parents,
+        and return the absolute filepath. The content defaults to the
+        relative path, so that each file has a different hash.
+        '''
+        filepath = os.path.join(self.temp.absolute_path, relative)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as handle:
+            handle.write(relative if content is None else content)
+        return filepath
+
+class PhotoDBTestCase(TempDirTestCase):
+    '''
+    Each test gets a new PhotoDB as self.photodb, which is closed afterwards
+    even if the test has replaced it.
+
+    The PhotoDB is ephemeral unless the class sets ephemeral = False, in which
+    case it is created in self.data_directory for the tests that need the
+    database on disk, such as to reopen it or connect to it twice.
+    '''
+    ephemeral = True
+
+    def setUp(self):
+        super().setUp()
+        if self.ephemeral:
+            self.photodb = etiquette.photodb.PhotoDB(ephemeral=True)
+        else:
+            self.data_directory = self.temp.with_child('_etiquette')
+            self.photodb = etiquette.photodb.PhotoDB(self.data_directory, create=True)
+        self.addCleanup(lambda: self.photodb.close())
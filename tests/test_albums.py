@@ -0,0 +1,102 @@
+import unittest
+
+import common
+
+class TestPurgeEmptyAlbums(common.PhotoDBTestCase):
+    def new_albums(self, *titles):
+        return [self.photodb.new_album(title) for title in titles]
+
+    def new_photo(self, name):
+        filepath = self.new_file(name)
+        return self.photodb.new_photo(filepath, do_metadata=False, do_thumbnail=False)
+
+    def purge(self, albums=None):
+        with self.photodb.transaction:
+            return {album.title for album in self.photodb.purge_empty_albums(albums)}
+
+    def remaining(self):
+        return {album.title for album in self.photodb.get_albums()}
+
+    def test_all_albums(self):
+        with self.photodb.transaction:
+            (a, b, c, d, e) = self.new_albums('a', 'b', 'c', 'd', 'e')
+            a.add_child(b)
+            a.add_child(c)
+            d.add_child(e)
+            e.add_photo(self.new_photo('e.txt'))
+
+        self.assertEqual(self.purge(), {'a', 'b', 'c'})
+        self.assertEqual(self.remaining(), {'d', 'e'})
+
+    def test_given_album_keeps_parent_with_other_children(self):
+        with self.photodb.transaction:
+            (a, b, c) = self.new_albums('a', 'b', 'c')
+            a.add_child(b)
+            a.add_child(c)
+
+        self.assertEqual(self.purge([b]), {'b'})
+        self.assertEqual(self.remaining(), {'a', 'c'})
+        self.assertEqual(a.get_children(), {c})
+
+    def test_given_album_takes_parents_left_childless(self):
+        with self.photodb.transaction:
+            (a, b, c, d) = self.new_albums('a', 'b', 'c', 'd')
+            a.add_child(b)
+            b.add_child(c)
+            d.add_child(c)
+            d.add_photo(self.new_photo('d.txt'))
+
+        self.assertEqual(self.purge([c]), {'a', 'b', 'c'})
+        self.assertEqual(self.remaining(), {'d'})
+
+    def test_given_album_takes_empty_descendants(self):
+        with self.photodb.transaction:
+            (a, b, c, d) = self.new_albums('a', 'b', 'c', 'd')
+            a.add_child(b)
+            b.add_child(c)
+            b.add_child(d)
+            d.add_photo(self.new_photo('d.txt'))
+
+        self.assertEqual(self.purge([a]), {'c'})
+        self.assertEqual(self.remaining(), {'a', 'b', 'd'})
+
+class TestAssociatedDirectories(common.PhotoDBTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.photodb.transaction:
+            self.album = self.photodb.new_album('album')
+
+    def make_directories(self, *names):
+        directories = [self.temp.with_child(name) for name in names]
+        for directory in directories:
+            directory.makedirs()
+        return directories
+
+    def count(self):
+        return self.photodb.select_one_value(
+            'SELECT COUNT(*) FROM album_associated_directories WHERE albumid == ?',
+            [self.album.id]
+        )
+
+    def test_nocase(self):
+        (upper, lower) = self.make_directories('Pictures', 'pictures')
+        with self.photodb.transaction:
+            self.album.add_associated_directories([upper, lower])
+        self.assertEqual(self.count(), 1)
+
+        with self.photodb.transaction:
+            self.album.add_associated_directories([lower])
+        self.assertEqual(self.count(), 1)
+
+    def test_nocase_ascii_only(self):
+        # SQLite's NOCASE does not fold non-ASCII letters, so these are
+        # different directories to the database as well.
+        (upper, lower) = self.make_directories('\u00c9t\u00e9', '\u00e9t\u00e9')
+        with self.photodb.transaction:
+            self.album.add_associated_directories([upper, lower])
+        self.assertEqual(self.count(), 2)
+        self.assertTrue(self.album.has_associated_directory(upper))
+        self.assertTrue(self.album.has_associated_directory(lower))
+
+if __name__ == '__main__':
+    unittest.main()
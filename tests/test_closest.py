@@ -0,0 +1,35 @@
+import unittest
+
+import etiquette
+
+import common
+
+class TestClosestPhotoDB(common.TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.temp
+        self.inner = self.root.with_child('inner')
+        self.deep = self.inner.with_child('deep')
+        self.deep.makedirs()
+
+    def test_nearer_datadir(self):
+        outer_datadir = self.root.with_child('_etiquette')
+        etiquette.photodb.PhotoDB(outer_datadir, create=True).close()
+        with etiquette.photodb.PhotoDB.closest_photodb(self.deep) as photodb:
+            self.assertEqual(photodb.data_directory, outer_datadir)
+
+        # A data directory created between the start and the one found
+        # before must be the next answer.
+        inner_datadir = self.inner.with_child('_etiquette')
+        etiquette.photodb.PhotoDB(inner_datadir, create=True).close()
+        with etiquette.photodb.PhotoDB.closest_photodb(self.deep) as photodb:
+            self.assertEqual(photodb.data_directory, inner_datadir)
+        with etiquette.photodb.PhotoDB.closest_photodb(self.root) as photodb:
+            self.assertEqual(photodb.data_directory, outer_datadir)
+
+    def test_none(self):
+        with self.assertRaises(etiquette.exceptions.NoClosestPhotoDB):
+            etiquette.photodb.PhotoDB.closest_photodb(self.deep)
+
+if __name__ == '__main__':
+    unittest.main()
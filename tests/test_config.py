@@ -0,0 +1,67 @@
+import copy
+import json
+import os
+import unittest
+
+import etiquette
+
+import common
+
+class TestConfig(common.PhotoDBTestCase):
+    ephemeral = False
+
+    def setUp(self):
+        super().setUp()
+        self.config_path = self.photodb.config_filepath.absolute_path
+
+    def read(self):
+        with open(self.config_path, 'rb') as handle:
+            return handle.read()
+
+    def reopen(self):
+        self.photodb.close()
+        self.photodb = etiquette.photodb.PhotoDB(self.data_directory)
+
+    def test_existing_file_is_not_rewritten(self):
+        # This is how config files have always been written.
+        config = copy.deepcopy(etiquette.constants.DEFAULT_CONFIGURATION)
+        content = json.dumps(config, indent=4, sort_keys=True).encode('utf-8')
+        with open(self.config_path, 'wb') as handle:
+            handle.write(content)
+        os.utime(self.config_path, (1, 1))
+
+        self.reopen()
+        self.photodb.save_config()
+        self.assertEqual(self.read(), content)
+        self.assertEqual(os.stat(self.config_path).st_mtime, 1)
+
+    def test_values_orjson_cannot_write(self):
+        self.photodb.config['thumbnail_width'] = 2 ** 70
+        self.photodb.config['thumbnail_height'] = 1e-05
+        self.photodb.save_config()
+        content = self.read()
+        self.assertEqual(json.loads(content)['thumbnail_width'], 2 ** 70)
+
+        self.reopen()
+        self.assertEqual(self.photodb.config['thumbnail_width'], 2 ** 70)
+        self.assertEqual(self.photodb.config['thumbnail_height'], 1e-05)
+        self.photodb.save_config()
+        self.assertEqual(self.read(), content)
+
+    def write_pragma(self, key):
+        # The memory pragmas are applied to the write connection.
+        return self.photodb.sql_write.execute(f'PRAGMA {key}').fetchone()[0]
+
+    def test_sqlite_pragmas(self):
+        self.assertEqual(self.write_pragma('cache_size'), -40000)
+        self.assertEqual(self.write_pragma('mmap_size'), 0)
+
+        self.photodb.config['sqlite']['cache_size_kib'] = 2000
+        self.photodb.config['sqlite']['mmap_size'] = 2 ** 20
+        self.photodb.save_config()
+        self.reopen()
+        self.assertEqual(self.write_pragma('cache_size'), -2000)
+        self.assertEqual(self.write_pragma('mmap_size'), 2 ** 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+import unittest
+
+import etiquette
+
+import common
+
+class Rollback(Exception):
+    pass
+
+class DigestTestCase(common.PhotoDBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.temp.with_child('root')
+        self.root.makedirs()
+
+    def write(self, relative, content=None):
+        return self.new_file(os.path.join('root', relative), relative if content is None else content)
+
+    def digest(self, **kwargs):
+        kwargs.setdefault('new_photo_kwargs', {'do_thumbnail': False})
+        return list(self.photodb.digest_directory(self.root, **kwargs))
+
+    def photos_by_basename(self):
+        return {photo.basename: photo for photo in self.photodb.get_photos()}
+
+class TestDigest(DigestTestCase):
+    def test_full_digest(self):
+        for name in ['a10.txt', 'a2.txt', 'a1.txt']:
+            self.write(name)
+        self.write('sub/b.txt')
+        self.write('sub/deeper/c.txt')
+
+        results = self.digest()
+        photos = [result for result in results if isinstance(result, etiquette.objects.Photo)]
+        albums = [result for result in results if isinstance(result, etiquette.objects.Album)]
+        self.assertEqual(len(photos), 5)
+        self.assertEqual(self.photodb.get_photo_count(), 5)
+        self.assertEqual({album.title for album in albums}, {'root', 'sub', 'deeper'})
+
+        # Natural sort decides the order the photos are created in.
+        root_photos = [photo.basename for photo in photos if photo.real_path.parent == self.root]
+        self.assertEqual(root_photos, ['a1.txt', 'a2.txt', 'a10.txt'])
+
+        for photo in photos:
+            with open(photo.real_path.absolute_path, 'rb') as handle:
+                self.assertEqual(photo.bytes, len(handle.read()))
+            self.assertEqual(len(photo.sha256), 64)
+
+        (root_album,) = self.photodb.get_albums_by_path(self.root)
+        (sub_album,) = self.photodb.get_albums_by_path(self.root.with_child('sub'))
+        (deeper_album,) = self.photodb.get_albums_by_path(self.root.with_child('sub').with_child('deeper'))
+        self.assertEqual(root_album.get_children(), {sub_album})
+        self.assertEqual(sub_album.get_children(), {deeper_album})
+        self.assertEqual({photo.basename for photo in sub_album.get_photos()}, {'b.txt'})
+
+    def test_redigest(self):
+        self.write('a.txt')
+        self.write('sub/b.txt')
+        first = self.digest()
+        second = self.digest()
+        self.assertEqual(set(first), set(second))
+        self.assertEqual(self.photodb.get_photo_count(), 2)
+        self.assertEqual(self.photodb.get_album_count(), 2)
+
+        new_only = self.digest(yield_old_photos=False, yield_albums=False)
+        self.assertEqual(new_only, [])
+
+    def test_results_per_directory(self):
+        self.write('a/1.txt')
+        self.write('b/2.txt')
+        generator = self.photodb.digest_directory(self.root, make_albums=False, new_photo_kwargs={'do_thumbnail': False})
+        first = next(generator)
+        # The first directory is written before its results are yielded.
+        self.assertEqual(self.photodb.get_photo(first.id), first)
+        self.assertEqual(len([first, *generator]), 2)
+
+class TestDigestRenames(DigestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('a.txt', 'aaaa')
+        self.write('b.txt', 'bbbb')
+        self.digest(make_albums=False)
+        self.original = self.photos_by_basename()
+
+    def test_rename_by_mtime_and_bytes(self):
+        os.rename(self.root.with_child('a.txt').absolute_path, self.root.with_child('c.txt').absolute_path)
+        self.digest(make_albums=False)
+        photos = self.photos_by_basename()
+        self.assertEqual(set(photos), {'b.txt', 'c.txt'})
+        self.assertEqual(photos['c.txt'].id, self.original['a.txt'].id)
+
+    def test_rename_by_hash(self):
+        old_path = self.root.with_child('a.txt').absolute_path
+        new_path = self.root.with_child('c.txt').absolute_path
+        os.rename(old_path, new_path)
+        stat = os.stat(new_path)
+        os.utime(new_path, (stat.st_atime, stat.st_mtime + 100))
+
+        self.digest(make_albums=False)
+        photos = self.photos_by_basename()
+        self.assertEqual(set(photos), {'b.txt', 'c.txt'})
+        self.assertEqual(photos['c.txt'].id, self.original['a.txt'].id)
+
+    def test_same_size_is_not_a_rename(self):
+        os.remove(self.root.with_child('a.txt').absolute_path)
+        filepath = self.write('c.txt', 'cccc')
+        stat = os.stat(filepath)
+        os.utime(filepath, (stat.st_atime, stat.st_mtime + 100))
+
+        self.digest(make_albums=False)
+        photos = self.photos_by_basename()
+        self.assertEqual(set(photos), {'a.txt', 'b.txt', 'c.txt'})
+        self.assertEqual(photos['a.txt'].id, self.original['a.txt'].id)
+        self.assertNotEqual(photos['c.txt'].id, self.original['a.txt'].id)
+
+class TestDigestTransactions(DigestTestCase):
+    def test_inside_caller_transaction(self):
+        self.write('a.txt')
+        self.write('sub/b.txt')
+        with self.photodb.transaction:
+            self.digest()
+            self.assertEqual(self.photodb.get_photo_count(), 2)
+        self.assertEqual(self.photodb.get_photo_count(), 2)
+        self.assertEqual(self.photodb.get_album_count(), 2)
+
+    def test_inside_caller_transaction_rollback(self):
+        self.write('a.txt')
+        self.write('sub/b.txt')
+        with self.assertRaises(Rollback):
+            with self.photodb.transaction:
+                self.digest()
+                raise Rollback()
+        self.assertEqual(self.photodb.get_photo_count(), 0)
+        self.assertEqual(self.photodb.get_album_count(), 0)
+
+    def test_early_close(self):
+        for directory in range(5):
+            for index in range(20):
+                self.write(f'{directory}/{index}.txt', 'x' * (directory * 100 + index))
+
+        threads_before = threading.active_count()
+        generator = self.photodb.digest_directory(self.root, new_photo_kwargs={'do_thumbnail': False})
+        next(generator)
+        generator.close()
+
+        # Nothing is left holding the transaction, and the walk and hash
+        # threads wind down.
+        self.assertIsNone(self.photodb._worms_transaction_owner)
+        deadline = time.monotonic() + 10
+        while threading.active_count() > threads_before and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(threading.active_count(), threads_before)
+
+        # The directories that were written are consistent, and a second
+        # digest picks up where the first left off.
+        partial = self.photodb.get_photo_count()
+        self.assertLess(partial, 100)
+        self.digest()
+        self.assertEqual(self.photodb.get_photo_count(), 100)
+
+if __name__ == '__main__':
+    unittest.main()
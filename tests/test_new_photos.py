@@ -0,0 +1,99 @@
+import collections
+import hashlib
+import unittest
+
+import etiquette
+
+import common
+
+class TestNewPhotos(common.PhotoDBTestCase):
+    def new_files(self, count, prefix='f'):
+        return [self.new_file(f'{prefix}{index}.txt') for index in range(count)]
+
+    def new_photos(self, filepaths, **kwargs):
+        kwargs.setdefault('do_thumbnail', False)
+        with self.photodb.transaction:
+            return self.photodb.new_photos(filepaths, **kwargs)
+
+    def assert_photos_match(self, filepaths, photos):
+        self.assertEqual([photo.real_path.absolute_path for photo in photos], filepaths)
+        self.assertEqual(len({photo.id for photo in photos}), len(photos))
+        for photo in photos:
+            self.assertEqual(self.photodb.get_photo(photo.id), photo)
+
+    def test_new_photos(self):
+        filepaths = self.new_files(3)
+        photos = self.new_photos(filepaths)
+        self.assert_photos_match(filepaths, photos)
+        self.assertEqual(self.photodb.get_photo_count(), 3)
+        for (filepath, photo) in zip(filepaths, photos):
+            with open(filepath, 'rb') as handle:
+                self.assertEqual(photo.sha256, hashlib.sha256(handle.read()).hexdigest())
+
+    def test_empty(self):
+        self.assertEqual(self.new_photos([]), [])
+
+    def test_photo_exists(self):
+        filepaths = self.new_files(2)
+        self.new_photos(filepaths[:1])
+        with self.assertRaises(etiquette.exceptions.PhotoExists):
+            self.new_photos(filepaths)
+        self.assertEqual(self.photodb.get_photo_count(), 1)
+
+    def test_known_hashes(self):
+        filepaths = self.new_files(2)
+        # The known hash is trusted rather than computed again, even when the
+        # rest of the metadata is loaded.
+        known = {filepaths[0]: 'ab' * 32}
+        photos = self.new_photos(filepaths, known_hashes=known)
+        self.assertEqual(photos[0].sha256, 'ab' * 32)
+        with open(filepaths[1], 'rb') as handle:
+            self.assertEqual(photos[1].sha256, hashlib.sha256(handle.read()).hexdigest())
+        self.assertEqual(list(self.photodb.get_photos_by_hash('ab' * 32)), [photos[0]])
+
+        filepaths = self.new_files(1, prefix='g')
+        (photo,) = self.new_photos(filepaths, known_hashes={filepaths[0]: 'cd' * 32}, do_metadata=False)
+        self.assertEqual(photo.sha256, 'cd' * 32)
+        self.assertIsNone(photo.bytes)
+
+    def test_tags(self):
+        with self.photodb.transaction:
+            foo = self.photodb.new_tag('foo')
+            self.photodb.new_tag('bar')
+        photos = self.new_photos(self.new_files(2), tags=[foo, 'bar'])
+        for photo in photos:
+            self.assertEqual({rel.tag.name for rel in photo.get_tags()}, {'foo', 'bar'})
+
+        with self.assertRaises(etiquette.exceptions.NoSuchTag):
+            self.new_photos(self.new_files(1, prefix='g'), tags=['nope'])
+        self.assertEqual(self.photodb.get_photo_count(), 2)
+
+    def test_id_collision_with_existing_photo(self):
+        (existing,) = self.new_photos(self.new_files(1, prefix='g'))
+        self.photodb._id_pool = collections.deque([existing.id, existing.id, 101, 102])
+        filepaths = self.new_files(2)
+        photos = self.new_photos(filepaths)
+        self.assert_photos_match(filepaths, photos)
+        self.assertEqual({photo.id for photo in photos}, {101, 102})
+
+    def test_id_collision_within_batch(self):
+        self.photodb._id_pool = collections.deque([201, 201, 202])
+        filepaths = self.new_files(2)
+        photos = self.new_photos(filepaths)
+        self.assert_photos_match(filepaths, photos)
+        self.assertEqual([photo.id for photo in photos], [201, 202])
+
+    def test_small_id_bits(self):
+        self.photodb.config['id_bits'] = 6
+        self.photodb.save_config()
+        self.photodb.load_config()
+        for batch in range(2):
+            filepaths = self.new_files(8, prefix=f'b{batch}_')
+            photos = self.new_photos(filepaths)
+            self.assert_photos_match(filepaths, photos)
+        ids = set(self.photodb.select_column('SELECT id FROM photos'))
+        self.assertEqual(len(ids), 16)
+        self.assertTrue(all(photo_id < 64 for photo_id in ids))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import threading
+import unittest
+
+import common
+
+class TestReadPool(common.PhotoDBTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.photodb.transaction:
+            for index in range(10):
+                self.photodb.new_tag(f'tag{index}')
+
+    def test_nested_reads_do_not_deadlock(self):
+        '''
+        More threads than there are pooled connections, each holding a select
+        open while making another read, must all finish.
+        '''
+        thread_count = self.photodb.config['read_connections'] * 2
+        barrier = threading.Barrier(thread_count)
+        finished = []
+
+        def nested_read():
+            rows = self.photodb.select('SELECT id FROM tags')
+            next(rows)
+            # Make sure every thread is holding its outer select before any
+            # of them asks for another connection.
+            barrier.wait()
+            for row in rows:
+                self.photodb.select_one_value('SELECT name FROM tags WHERE id == ?', [row[0]])
+            finished.append(True)
+
+        threads = [threading.Thread(target=nested_read, daemon=True) for x in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        self.assertEqual(len(finished), thread_count)
+
+    def test_abandoned_select_keeps_no_pooled_reader_waiting(self):
+        abandoned = []
+        for x in range(self.photodb.config['read_connections'] + 1):
+            rows = self.photodb.select('SELECT id FROM tags')
+            next(rows)
+            abandoned.append(rows)
+        self.assertEqual(self.photodb.get_tag_count(), 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import unittest
+
+import common
+
+class TestSearchLimitOffset(common.PhotoDBTestCase):
+    def setUp(self):
+        super().setUp()
+        # Every third photo has "cat" in its name, including the last one.
+        self.names = [f'{index:02d}cat.txt' if index % 3 == 2 else f'{index:02d}dog.txt' for index in range(12)]
+        filepaths = [self.new_file(name) for name in self.names]
+        with self.photodb.transaction:
+            self.photodb.new_photos(filepaths, do_metadata=False, do_thumbnail=False)
+        self.cats = [name for name in self.names if 'cat' in name]
+
+    def search(self, **kwargs):
+        search = self.photodb.search(
+            orderby='basename-asc',
+            yield_albums=False,
+            yield_photos=True,
+            **kwargs,
+        )
+        names = [photo.basename for photo in search.results]
+        return (search, names)
+
+    def test_limit(self):
+        (search, names) = self.search(limit=3)
+        self.assertEqual(names, self.names[:3])
+        self.assertTrue(search.more_after_limit)
+        self.assertIn('LIMIT', search.query)
+
+        (search, names) = self.search(limit=12)
+        self.assertEqual(names, self.names)
+        self.assertFalse(search.more_after_limit)
+
+        (search, names) = self.search(limit=20)
+        self.assertEqual(names, self.names)
+        self.assertFalse(search.more_after_limit)
+
+    def test_offset(self):
+        (search, names) = self.search(offset=4)
+        self.assertEqual(names, self.names[4:])
+        self.assertFalse(search.more_after_limit)
+
+        (search, names) = self.search(offset=20)
+        self.assertEqual(names, [])
+
+    def test_limit_offset(self):
+        (search, names) = self.search(limit=3, offset=4)
+        self.assertEqual(names, self.names[4:7])
+        self.assertTrue(search.more_after_limit)
+        self.assertIn('OFFSET', search.query)
+
+        (search, names) = self.search(limit=3, offset=9)
+        self.assertEqual(names, self.names[9:])
+        self.assertFalse(search.more_after_limit)
+
+        (search, names) = self.search(limit=3, offset=10)
+        self.assertEqual(names, self.names[10:])
+        self.assertFalse(search.more_after_limit)
+
+    def test_filename_limit_offset(self):
+        # The filename filter runs in Python, so the offset and limit have to
+        # be applied to the filtered rows rather than in SQL.
+        (search, names) = self.search(filename='cat')
+        self.assertEqual(names, self.cats)
+        self.assertNotIn('LIMIT', search.query)
+
+        (search, names) = self.search(filename='cat', limit=2)
+        self.assertEqual(names, self.cats[:2])
+        self.assertTrue(search.more_after_limit)
+
+        (search, names) = self.search(filename='cat', limit=2, offset=1)
+        self.assertEqual(names, self.cats[1:3])
+        self.assertTrue(search.more_after_limit)
+
+        (search, names) = self.search(filename='cat', limit=2, offset=2)
+        self.assertEqual(names, self.cats[2:4])
+        self.assertFalse(search.more_after_limit)
+
+        (search, names) = self.search(filename='cat', offset=3)
+        self.assertEqual(names, self.cats[3:])
+
+    def test_filename_deeply_nested(self):
+        # Too deep for the compiled matcher, so the tree gets evaluated.
+        (search, names) = self.search(filename='NOT (' * 200 + 'cat' + ')' * 200)
+        self.assertEqual(names, self.cats)
+
+        (search, names) = self.search(filename='NOT (' * 201 + 'cat' + ')' * 201)
+        self.assertEqual(names, [name for name in self.names if name not in self.cats])
+
+    def test_columns(self):
+        columns = self.photodb.search_columns(columns=['filepath'], orderby='basename-asc', limit=3, offset=4)
+        self.assertEqual([os.path.basename(f) for f in columns['filepath']], self.names[4:7])
+        columns = self.photodb.search_columns(columns=['filepath'], orderby='basename-asc', filename='cat', limit=2, offset=1)
+        self.assertEqual([os.path.basename(f) for f in columns['filepath']], self.cats[1:3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+import common
+
+NUMBERS = '''
+WITH RECURSIVE numbers(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM numbers WHERE x < 3000)
+SELECT x FROM numbers
+'''
+
+class TestSelectIn(common.PhotoDBTestCase):
+    def select_in(self, query, values):
+        return sorted(x for (x,) in self.photodb._select_in(NUMBERS + query, values))
+
+    def test_batches(self):
+        values = list(range(0, 4000, 2))
+        self.assertEqual(self.select_in('WHERE x IN ({qmarks})', values), list(range(2, 3001, 2)))
+        self.assertEqual(self.select_in('WHERE x IN ({qmarks})', []), [])
+
+    def test_repeated_qmarks(self):
+        # Each batch is bound once for each {qmarks}, so the batches have to
+        # shrink to stay under the limit.
+        values = list(range(1, 1501))
+        query = 'WHERE x IN ({qmarks}) OR x - 1500 IN ({qmarks})'
+        self.assertEqual(self.select_in(query, values), list(range(1, 3001)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import contextlib
+import hashlib
+import importlib.util
+import io
+import os
+import sqlite3
+import unittest
+
+import etiquette
+
+import common
+
+UPGRADER_PATH = os.path.join(os.path.dirname(__file__), '..', 'utilities', 'database_upgrader.py')
+
+def import_upgrader():
+    spec = importlib.util.spec_from_file_location('database_upgrader', UPGRADER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class Sha256TestCase(common.PhotoDBTestCase):
+    def new_hashed_file(self, name):
+        filepath = self.new_file(name)
+        with open(filepath, 'rb') as handle:
+            sha256 = hashlib.sha256(handle.read()).hexdigest()
+        return (filepath, sha256)
+
+class TestSha256RoundTrip(Sha256TestCase):
+    def setUp(self):
+        super().setUp()
+        (filepath, self.sha256) = self.new_hashed_file('a.txt')
+        with self.photodb.transaction:
+            self.photo = self.photodb.new_photo(filepath, do_thumbnail=False)
+
+    def test_stored_as_bytes(self):
+        self.assertEqual(self.photo.sha256, self.sha256)
+        row = self.photodb.select_one('SELECT typeof(sha256), sha256 FROM photos')
+        self.assertEqual(row[0], 'blob')
+        self.assertEqual(row[1], bytes.fromhex(self.sha256))
+
+    def test_reloaded_as_hex(self):
+        self.photodb.caches[etiquette.objects.Photo].clear()
+        photo = self.photodb.get_photo(self.photo.id)
+        self.assertIsNot(photo, self.photo)
+        self.assertEqual(photo.sha256, self.sha256)
+
+    def test_get_photos_by_hash(self):
+        self.assertEqual(list(self.photodb.get_photos_by_hash(self.sha256)), [self.photo])
+        self.assertEqual(list(self.photodb.get_photos_by_hash(bytes.fromhex(self.sha256))), [self.photo])
+        self.assertEqual(list(self.photodb.get_photos_by_hashes([self.sha256, '0' * 64])), [self.photo])
+        with self.assertRaises(TypeError):
+            list(self.photodb.get_photos_by_hash('abc'))
+
+    def test_known_hash(self):
+        (filepath, sha256) = self.new_hashed_file('b.txt')
+        with self.photodb.transaction:
+            photo = self.photodb.new_photo(filepath, known_hash=sha256, do_metadata=False, do_thumbnail=False)
+        self.assertEqual(photo.sha256, sha256)
+        self.assertEqual(list(self.photodb.get_photos_by_hash(sha256)), [photo])
+
+    def test_search(self):
+        search = self.photodb.search(sha256=self.sha256, yield_photos=True, yield_albums=False)
+        self.assertEqual(list(search.results), [self.photo])
+        columns = self.photodb.search_columns(columns=['id', 'sha256'])
+        self.assertEqual(columns, {'id': [self.photo.id], 'sha256': [self.sha256]})
+
+class TestUpgrade25To26(Sha256TestCase):
+    ephemeral = False
+
+    def test_upgrade(self):
+        (filepath, sha256) = self.new_hashed_file('a.txt')
+        (nohash_filepath, nohash_sha256) = self.new_hashed_file('b.txt')
+        with self.photodb.transaction:
+            photo = self.photodb.new_photo(filepath, do_thumbnail=False)
+            nohash = self.photodb.new_photo(nohash_filepath, do_metadata=False, do_thumbnail=False)
+        self.photodb.close()
+
+        # Put the hashes back the way version 25 stored them.
+        sql = sqlite3.connect(self.data_directory.with_child(etiquette.constants.DEFAULT_DBNAME).absolute_path)
+        sql.execute('DROP INDEX index_photos_sha256')
+        sql.execute('UPDATE photos SET sha256 = lower(hex(sha256)) WHERE sha256 IS NOT NULL')
+        sql.execute('PRAGMA user_version = 25')
+        sql.commit()
+        sql.close()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            import_upgrader().upgrade_all(self.data_directory)
+
+        self.photodb = etiquette.photodb.PhotoDB(self.data_directory)
+        self.assertEqual(self.photodb.pragma_read('user_version'), etiquette.constants.DATABASE_VERSION)
+        rows = dict(self.photodb.select('SELECT id, typeof(sha256) FROM photos'))
+        self.assertEqual(rows, {photo.id: 'blob', nohash.id: 'null'})
+        self.assertEqual(self.photodb.get_photo(photo.id).sha256, sha256)
+        self.assertIsNone(self.photodb.get_photo(nohash.id).sha256)
+        self.assertEqual([p.id for p in self.photodb.get_photos_by_hash(sha256)], [photo.id])
+        indices = set(self.photodb.select_column('SELECT name FROM sqlite_master WHERE type == "index"'))
+        self.assertIn('index_photos_sha256', indices)
+
+if __name__ == '__main__':
+    unittest.main()
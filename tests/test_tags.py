@@ -0,0 +1,74 @@
+import unittest
+
+import etiquette
+
+import common
+
+class Rollback(Exception):
+    pass
+
+class TestTagByName(common.PhotoDBTestCase):
+    # test_other_connection opens the same database a second time.
+    ephemeral = False
+
+    def setUp(self):
+        super().setUp()
+        with self.photodb.transaction:
+            self.tag = self.photodb.new_tag('foo')
+
+    def test_cached_name(self):
+        self.assertEqual(self.photodb.get_tag(name='foo'), self.tag)
+        self.assertEqual(self.photodb.get_tag(name='foo'), self.tag)
+
+    def test_rolled_back_synonym(self):
+        with self.assertRaises(Rollback):
+            with self.photodb.transaction:
+                self.tag.add_synonym('bar')
+                self.assertEqual(self.photodb.get_tag(name='bar'), self.tag)
+                raise Rollback()
+
+        with self.assertRaises(etiquette.exceptions.NoSuchTag):
+            self.photodb.get_tag(name='bar')
+
+    def test_rolled_back_rename(self):
+        with self.assertRaises(Rollback):
+            with self.photodb.transaction:
+                self.tag.rename('baz')
+                self.assertEqual(self.photodb.get_tag(name='baz').id, self.tag.id)
+                raise Rollback()
+
+        with self.assertRaises(etiquette.exceptions.NoSuchTag):
+            self.photodb.get_tag(name='baz')
+        self.assertEqual(self.photodb.get_tag(name='foo').id, self.tag.id)
+
+    def test_committed_synonym(self):
+        self.assertEqual(self.photodb.get_tag(name='foo'), self.tag)
+        with self.photodb.transaction:
+            self.tag.add_synonym('bar')
+        self.assertEqual(self.photodb.get_tag(name='bar'), self.tag)
+        with self.photodb.transaction:
+            self.tag.remove_synonym('bar')
+        with self.assertRaises(etiquette.exceptions.NoSuchTag):
+            self.photodb.get_tag(name='bar')
+
+    def test_other_connection(self):
+        other = etiquette.photodb.PhotoDB(self.data_directory)
+        try:
+            self.assertEqual(other.get_tag(name='foo').id, self.tag.id)
+            with self.photodb.transaction:
+                self.tag.rename('qux')
+                new_foo = self.photodb.new_tag('foo')
+            self.assertEqual(other.get_tag(name='foo').id, new_foo.id)
+
+            with self.photodb.transaction:
+                new_foo.add_synonym('bar')
+            self.assertEqual(other.get_tag(name='bar').id, new_foo.id)
+            with self.photodb.transaction:
+                new_foo.remove_synonym('bar')
+                new_bar = self.photodb.new_tag('bar')
+            self.assertEqual(other.get_tag(name='bar').id, new_bar.id)
+        finally:
+            other.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1059,6 +1059,71 @@ def upgrade_24_to_25(photodb):
     '''
     m.go()
 
+def upgrade_25_to_26(photodb):
+    '''
+    In this version, photos.sha256 changed from the 64-character hexdigest
+    TEXT to the 32-byte digest BLOB, and got an index.
+    '''
+    m = Migrator(photodb)
+    m.tables['photos']['create'] = '''
+    CREATE TABLE IF NOT EXISTS photos(
+        id INT PRIMARY KEY NOT NULL,
+        filepath TEXT COLLATE NOCASE,
+        override_filename TEXT COLLATE NOCASE,
+        mtime INT,
+        sha256 BLOB,
+        width INT,
+        height INT,
+        duration INT,
+        bytes INT,
+        created INT,
+        tagged_at INT,
+        author_id INT,
+        searchhidden BOOLEAN,
+        -- GENERATED COLUMNS
+        area INT GENERATED ALWAYS AS (width * height) VIRTUAL,
+        aspectratio REAL GENERATED ALWAYS AS (1.0 * width / height) VIRTUAL,
+        -- Thank you ungalcrys
+        -- https://stackoverflow.com/a/38330814/5430534
+        basename TEXT GENERATED ALWAYS AS (
+            COALESCE(
+                override_filename,
+                replace(filepath, rtrim(filepath, replace(replace(filepath, '\\', '/'), '/', '')), '')
+            )
+        ) STORED COLLATE NOCASE,
+        extension TEXT GENERATED ALWAYS AS (
+            replace(basename, rtrim(basename, replace(basename, '.', '')), '')
+        ) VIRTUAL COLLATE NOCASE,
+        bitrate REAL GENERATED ALWAYS AS ((bytes / 128) / duration) VIRTUAL,
+        FOREIGN KEY(author_id) REFERENCES users(id)
+    );
+    '''
+    m.tables['photos']['transfer'] = '''
+    INSERT INTO photos SELECT
+        id,
+        filepath,
+        override_filename,
+        mtime,
+        sha256,
+        width,
+        height,
+        duration,
+        bytes,
+        created,
+        tagged_at,
+        author_id,
+        searchhidden
+    FROM photos_old;
+    '''
+    m.go()
+
+    rows = list(photodb.select('SELECT id, sha256 FROM photos WHERE sha256 IS NOT NULL'))
+    photodb.executemany(
+        'UPDATE photos SET sha256 = ? WHERE id == ?',
+        [(bytes.fromhex(sha256), photoid) for (photoid, sha256) in rows]
+    )
+    photodb.execute('CREATE INDEX IF NOT EXISTS index_photos_sha256 on photos(sha256)')
+
 def upgrade_all(data_directory):
     '''
     Given the directory containing a phototagger database, apply all of the